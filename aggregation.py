@@ -0,0 +1,128 @@
+import hashlib
+import json
+import pandas as pd
+import streamlit as st
+from chatbot import PrimaryToSecondaryMapping, SecondaryToPrimaryMapping
+from transcript import timestamp_ms
+
+SECONDARY_TO_PRIMARY = {k.value: v for k, v in SecondaryToPrimaryMapping.items()}
+SECONDARY_ORDER = [s for p in PrimaryToSecondaryMapping.values() for s in p]
+
+MAX_CACHED_AGGREGATIONS = 64
+
+
+def analysis_version(analysis_json: dict) -> str:
+    return hashlib.sha1(
+        json.dumps(analysis_json, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def flatten_modes(
+    mode_analyses: dict[str, dict], timestamps: dict[str, str]
+) -> pd.DataFrame:
+    recording_ids, labels = [], []
+    for recording_id, analysis_json in mode_analyses.items():
+        for mode in analysis_json["modes"]:
+            recording_ids.append(recording_id)
+            labels.append(getattr(mode["label"], "value", mode["label"]))
+    frame = pd.DataFrame({"recording_id": recording_ids, "mode": labels})
+    frame["timestamp"] = frame["recording_id"].map(timestamps)
+    return frame
+
+
+def mode_percentages(frame: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    per_recording = (
+        frame.groupby(["recording_id", "timestamp", "mode"])
+        .size()
+        .rename("count")
+        .reset_index()
+    )
+    per_recording["num_intervals"] = per_recording.groupby("recording_id")[
+        "count"
+    ].transform("sum")
+    per_recording["percent"] = (
+        per_recording["count"] * 100 / per_recording["num_intervals"]
+    )
+    overall = frame.groupby("mode").size().rename("count").reset_index()
+    overall["tot_num_intervals"] = len(frame)
+    overall["percent"] = overall["count"] * 100 / len(frame)
+    return per_recording, overall
+
+
+@st.cache_data(max_entries=MAX_CACHED_AGGREGATIONS)
+def _mode_chart_data(
+    key: tuple, _mode_analyses: dict[str, dict], _timestamps: dict[str, str]
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    return mode_percentages(flatten_modes(_mode_analyses, _timestamps))
+
+
+def mode_chart_data(
+    mode_analyses: dict[str, dict], timestamps: dict[str, str]
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Per-recording and overall mode percentages, recomputed only when the set of
+    recordings or one of their analyses changes"""
+    key = tuple(
+        (recording_id, str(timestamps[recording_id]), analysis_version(a))
+        for recording_id, a in sorted(mode_analyses.items())
+    )
+    return _mode_chart_data(key, mode_analyses, timestamps)
+
+
+def flatten_emotions(
+    emotion_analyses: dict[str, dict], timestamps: dict[str, str]
+) -> pd.DataFrame:
+    recording_ids, start_ms, labels = [], [], []
+    for recording_id, analysis_json in emotion_analyses.items():
+        for emotion in analysis_json["emotions"]:
+            try:
+                start = timestamp_ms(emotion["start_time"])
+            except ValueError:
+                continue
+            for label in emotion["labels"]:
+                recording_ids.append(recording_id)
+                start_ms.append(start)
+                labels.append(getattr(label, "value", label))
+    frame = pd.DataFrame(
+        {"recording_id": recording_ids, "start_ms": start_ms, "secondary": labels}
+    )
+    frame["timestamp"] = frame["recording_id"].map(timestamps)
+    frame["primary"] = frame["secondary"].map(SECONDARY_TO_PRIMARY)
+    return frame
+
+
+def emotion_rollup(
+    frame: pd.DataFrame, interval: int
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Primary and secondary emotion counts per interval-minute bucket"""
+    frame = frame.assign(
+        start_minute=frame["start_ms"] // (interval * 60000) * interval
+    )
+    keys = ["recording_id", "timestamp", "start_minute"]
+    primary = frame.groupby(keys + ["primary"]).size().rename("count").reset_index()
+    secondary = (
+        frame.groupby(keys + ["primary", "secondary"])
+        .size()
+        .rename("count")
+        .reset_index()
+    )
+    return primary, secondary
+
+
+@st.cache_data(max_entries=MAX_CACHED_AGGREGATIONS)
+def _emotion_chart_data(
+    key: tuple,
+    interval: int,
+    _emotion_analyses: dict[str, dict],
+    _timestamps: dict[str, str],
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    return emotion_rollup(flatten_emotions(_emotion_analyses, _timestamps), interval)
+
+
+def emotion_chart_data(
+    emotion_analyses: dict[str, dict], timestamps: dict[str, str], interval: int
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    key = tuple(
+        (recording_id, str(timestamps[recording_id]), analysis_version(a))
+        for recording_id, a in sorted(emotion_analyses.items())
+    )
+    return _emotion_chart_data(key, interval, emotion_analyses, timestamps)
@@ -0,0 +1,58 @@
+def speaker_spans(
+    utterances: list, use_words: bool = True
+) -> tuple[list[int], list[int], list[str]]:
+    starts, ends, speakers = [], [], []
+    for utterance in utterances:
+        words = getattr(utterance, "words", None) if use_words else None
+        for span in words or [utterance]:
+            starts.append(span.start)
+            ends.append(span.end)
+            speakers.append(utterance.speaker)
+    return starts, ends, speakers
+
+
+def align_speakers(
+    cue_starts: list[int],
+    cue_ends: list[int],
+    span_starts: list[int],
+    span_ends: list[int],
+    span_speakers: list[str],
+) -> list[str | None]:
+    """Assigns each cue the speaker whose spans overlap it the most.
+
+    Cues and spans must be sorted by start time and spans must not overlap each
+    other, which holds for both AssemblyAI utterances and words. Cues that fall
+    in a gap between spans take the speaker of the nearest span.
+    """
+    n = len(span_starts)
+    rv = []
+    j = 0
+    for start, end in zip(cue_starts, cue_ends):
+        while j < n and span_ends[j] <= start:
+            j += 1
+        overlaps = {}
+        k = j
+        while k < n and span_starts[k] < end:
+            overlap = min(end, span_ends[k]) - max(start, span_starts[k])
+            if overlap > 0:
+                overlaps[span_speakers[k]] = overlaps.get(span_speakers[k], 0) + overlap
+            k += 1
+        if overlaps:
+            rv.append(max(overlaps, key=overlaps.get))
+        elif n:
+            rv.append(span_speakers[_nearest(span_starts, span_ends, start, end, j)])
+        else:
+            rv.append(None)
+    return rv
+
+
+def _nearest(
+    span_starts: list[int], span_ends: list[int], start: int, end: int, j: int
+) -> int:
+    if j >= len(span_starts):
+        return len(span_starts) - 1
+    if j == 0:
+        return 0
+    if start - span_ends[j - 1] <= span_starts[j] - end:
+        return j - 1
+    return j
@@ -0,0 +1,116 @@
+import atexit
+import streamlit as st
+from cascade import ModelCascade
+from chatbot import Chatbot, CombinedAnalysis
+from clients import get_registry
+from jobs import Job, SQLiteJobQueue, WorkerPool
+from recording_processor import RecordingProcessor
+from store import DBClient
+
+ANALYSIS_MODEL_ID = "gpt-4o-2024-08-06"
+# background analyses try this model first and escalate to ANALYSIS_MODEL_ID
+CASCADE_MODEL_ID = "gpt-4o-mini-2024-07-18"
+CASCADE_ANALYSIS = True
+MODE_INTERVAL = 1
+# emotions are analyzed once at this granularity and rolled up for coarser views
+EMOTION_INTERVAL = 1
+JOB_MODE = "mode"
+JOB_EMOTION = "emotion"
+JOB_COMBINED = "combined"
+# while both analyses run at the same interval, one call produces both
+COMBINED_ANALYSIS = MODE_INTERVAL == EMOTION_INTERVAL
+
+
+def analysis_job_kind(kind: str) -> str:
+    return JOB_COMBINED if COMBINED_ANALYSIS else kind
+
+
+def enqueue_recording_analysis(
+    queue: SQLiteJobQueue, recording_id: str, force: bool = False
+) -> None:
+    if COMBINED_ANALYSIS:
+        queue.enqueue(JOB_COMBINED, recording_id, MODE_INTERVAL, force=force)
+        return
+    queue.enqueue(JOB_MODE, recording_id, MODE_INTERVAL, force=force)
+    queue.enqueue(JOB_EMOTION, recording_id, EMOTION_INTERVAL, force=force)
+
+
+def persist_combined_analysis(
+    db_client: DBClient, recording_id: str, interval: int, analysis: CombinedAnalysis
+) -> None:
+    db_client.insert_mode_analysis(recording_id, analysis.mode_analysis().model_dump())
+    db_client.insert_emotion_analysis(
+        recording_id, interval, analysis.emotion_analysis().model_dump()
+    )
+
+
+def analysis_cascade(chatbot: Chatbot) -> ModelCascade | None:
+    if not CASCADE_ANALYSIS:
+        return None
+    return ModelCascade(
+        chatbot.client,
+        CASCADE_MODEL_ID,
+        chatbot.model_id,
+        temperature=chatbot.temperature,
+    )
+
+
+def run_analysis_job(
+    job: Job,
+    db_client: DBClient,
+    chatbot: Chatbot,
+    cascade: ModelCascade | None = None,
+) -> None:
+    recording = db_client.get_recording(job.recording_id)
+    if recording is None:
+        # deleted since it was queued, e.g. a failed recording's partial transcript
+        return
+    rp = RecordingProcessor(
+        id=recording["id"],
+        ts=recording["created_at"],
+        transcript=recording["transcript"],
+        chatbot=chatbot,
+        db_client=db_client,
+        transcript_compact=recording.get("transcript_compact"),
+        cascade=cascade,
+    )
+    match job.kind:
+        case "mode":
+            db_client.insert_mode_analysis(
+                rp.id, rp.get_windowed_mode_analysis(job.interval).model_dump()
+            )
+        case "emotion":
+            db_client.insert_emotion_analysis(
+                rp.id,
+                job.interval,
+                rp.get_windowed_emotion_analysis(job.interval).model_dump(),
+            )
+        case "combined":
+            persist_combined_analysis(
+                db_client,
+                rp.id,
+                job.interval,
+                rp.get_windowed_combined_analysis(job.interval),
+            )
+        case _:
+            raise ValueError(f"Unknown analysis job kind {job.kind}")
+
+
+@st.cache_resource
+def get_job_queue() -> SQLiteJobQueue:
+    return SQLiteJobQueue(st.secrets.get("JOB_QUEUE_PATH", ".analysis_jobs.sqlite3"))
+
+
+@st.cache_resource
+def get_worker_pool() -> WorkerPool:
+    db_client = get_registry().db_client()
+    chatbot = Chatbot(model_id=ANALYSIS_MODEL_ID, temperature=0.0)
+    cascade = analysis_cascade(chatbot)
+    pool = WorkerPool(
+        get_job_queue(),
+        lambda job: run_analysis_job(job, db_client, chatbot, cascade),
+        num_workers=int(st.secrets.get("ANALYSIS_WORKERS", 4)),
+    )
+    pool.start()
+    atexit.register(pool.stop)
+    return pool
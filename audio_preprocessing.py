@@ -0,0 +1,185 @@
+import subprocess
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Iterator
+import imageio_ffmpeg
+import numpy as np
+from chunked_transcription import AudioChunk, CHUNK_SECS, OVERLAP_SECS
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+MIN_SILENCE_MS = 1000
+KEEP_SILENCE_MS = 250
+NOISE_FLOOR_PERCENTILE = 10
+SPEECH_MARGIN_DB = 12
+MIN_SPEECH_DB = -55
+# anything louder than this is speech however quiet the rest of the recording is
+MAX_SPEECH_DB = -35
+SPEECH_PERCENTILE = 90
+# recordings without this much spread between their quiet and loud frames have
+# no silence to find, e.g. when someone talks throughout
+MIN_SPREAD_DB = 15
+OPUS_BITRATE = "24k"
+
+
+class TimeMap:
+    """Maps times in trimmed audio back to the original recording"""
+
+    def __init__(self, trimmed_starts: list[int], original_starts: list[int]) -> None:
+        self.trimmed_starts = trimmed_starts
+        self.original_starts = original_starts
+
+    def to_original(self, ms: int, is_end: bool = False) -> int:
+        if not self.trimmed_starts:
+            return ms
+        # an end time on a segment boundary belongs to the segment before it
+        find = bisect_left if is_end else bisect_right
+        i = max(find(self.trimmed_starts, ms) - 1, 0)
+        return self.original_starts[i] + ms - self.trimmed_starts[i]
+
+
+@dataclass
+class PreprocessedAudio:
+    samples: np.ndarray
+    time_map: TimeMap
+    original_bytes: int
+    original_ms: int
+    encoded_bytes: int = 0
+
+    @property
+    def duration_ms(self) -> int:
+        return len(self.samples) * 1000 // SAMPLE_RATE
+
+
+def _ffmpeg(args: list[str], data: bytes) -> bytes:
+    return subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error"] + args,
+        input=data,
+        capture_output=True,
+        check=True,
+    ).stdout
+
+
+def decode(audio: bytes) -> np.ndarray:
+    """Decodes any ffmpeg-readable audio to 16 kHz mono 16-bit samples"""
+    pcm = _ffmpeg(
+        ["-i", "pipe:0", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"],
+        audio,
+    )
+    return np.frombuffer(pcm, dtype=np.int16)
+
+
+def encode(samples: np.ndarray) -> bytes:
+    return _ffmpeg(
+        [
+            "-f",
+            "s16le",
+            "-ar",
+            str(SAMPLE_RATE),
+            "-ac",
+            "1",
+            "-i",
+            "pipe:0",
+            "-c:a",
+            "libopus",
+            "-b:a",
+            OPUS_BITRATE,
+            "-application",
+            "voip",
+            "-f",
+            "ogg",
+            "pipe:1",
+        ],
+        samples.tobytes(),
+    )
+
+
+def speech_frames(samples: np.ndarray) -> np.ndarray:
+    """Energy-based voice activity per FRAME_MS frame, thresholded against the
+    recording's own noise floor but never above MAX_SPEECH_DB"""
+    frame_len = SAMPLE_RATE * FRAME_MS // 1000
+    num_frames = len(samples) // frame_len
+    if not num_frames:
+        return np.ones(1 if len(samples) else 0, dtype=bool)
+    frames = (
+        samples[: num_frames * frame_len]
+        .astype(np.float32)
+        .reshape(num_frames, frame_len)
+    )
+    rms = np.sqrt(np.mean(frames**2, axis=1)) / 32768
+    db = 20 * np.log10(np.maximum(rms, 1e-10))
+    noise_floor = np.percentile(db, NOISE_FLOOR_PERCENTILE)
+    if np.percentile(db, SPEECH_PERCENTILE) - noise_floor < MIN_SPREAD_DB:
+        speech = np.ones(num_frames, dtype=bool)
+    else:
+        threshold = min(
+            max(noise_floor + SPEECH_MARGIN_DB, MIN_SPEECH_DB), MAX_SPEECH_DB
+        )
+        speech = db > threshold
+    if len(samples) > num_frames * frame_len:
+        speech = np.append(speech, speech[-1])
+    return speech
+
+
+def trim_silence(samples: np.ndarray) -> tuple[np.ndarray, TimeMap]:
+    """Cuts silences longer than MIN_SILENCE_MS down to KEEP_SILENCE_MS of padding
+    on each side"""
+    frame_len = SAMPLE_RATE * FRAME_MS // 1000
+    speech = speech_frames(samples)
+    min_frames = MIN_SILENCE_MS // FRAME_MS
+    keep_frames = KEEP_SILENCE_MS // FRAME_MS
+    keep = np.ones(len(speech), dtype=bool)
+    # run boundaries of the silent stretches
+    padded = np.concatenate(([False], ~speech, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    for start, end in zip(edges[::2], edges[1::2]):
+        if end - start >= min_frames:
+            keep[start + keep_frames : end - keep_frames] = False
+
+    padded = np.concatenate(([False], keep, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    segments = []
+    trimmed_starts, original_starts = [], []
+    trimmed_ms = 0
+    for start, end in zip(edges[::2], edges[1::2]):
+        segment = samples[start * frame_len : end * frame_len]
+        trimmed_starts.append(trimmed_ms)
+        original_starts.append(start * FRAME_MS)
+        trimmed_ms += len(segment) * 1000 // SAMPLE_RATE
+        segments.append(segment)
+    trimmed = np.concatenate(segments) if segments else samples[:0]
+    return trimmed, TimeMap(trimmed_starts, original_starts)
+
+
+def preprocess(audio: bytes) -> PreprocessedAudio:
+    samples = decode(audio)
+    trimmed, time_map = trim_silence(samples)
+    return PreprocessedAudio(
+        samples=trimmed,
+        time_map=time_map,
+        original_bytes=len(audio),
+        original_ms=len(samples) * 1000 // SAMPLE_RATE,
+    )
+
+
+def iter_encoded_chunks(
+    audio: PreprocessedAudio,
+    chunk_secs: int = CHUNK_SECS,
+    overlap_secs: int = OVERLAP_SECS,
+) -> Iterator[AudioChunk]:
+    chunk_len = chunk_secs * SAMPLE_RATE
+    overlap_len = overlap_secs * SAMPLE_RATE
+    for index, start in enumerate(
+        range(0, max(len(audio.samples) - overlap_len, 1), chunk_len)
+    ):
+        samples = audio.samples[start : start + chunk_len + overlap_len]
+        if not len(samples):
+            break
+        data = encode(samples)
+        audio.encoded_bytes += len(data)
+        yield AudioChunk(
+            index=index,
+            offset_ms=start * 1000 // SAMPLE_RATE,
+            duration_ms=len(samples) * 1000 // SAMPLE_RATE,
+            data=data,
+        )
@@ -0,0 +1,77 @@
+import argparse
+import json
+import random
+import time
+from types import SimpleNamespace
+from aligner import align_speakers, speaker_spans
+
+
+def synthetic_transcript(hours: float, seed: int = 0) -> tuple[list, list, list, list]:
+    """Generates alternating-speaker utterances and 5-15 word captions over them"""
+    rng = random.Random(seed)
+    duration_ms = int(hours * 3600 * 1000)
+    utterances = []
+    t = 0
+    speaker = "A"
+    while t < duration_ms:
+        words = []
+        for _ in range(rng.randint(3, 60)):
+            start = t + rng.randint(0, 200)
+            end = start + rng.randint(150, 600)
+            words.append(SimpleNamespace(start=start, end=end))
+            t = end
+        utterances.append(
+            SimpleNamespace(
+                speaker=speaker, start=words[0].start, end=words[-1].end, words=words
+            )
+        )
+        speaker = "B" if speaker == "A" else "A"
+        t += rng.randint(100, 1500)
+
+    # captions are cut from the word stream regardless of utterance boundaries,
+    # so some of them straddle a speaker change
+    words = [(w, u.speaker) for u in utterances for w in u.words]
+    cue_starts, cue_ends, expected = [], [], []
+    i = 0
+    while i < len(words):
+        cue = words[i : i + rng.randint(5, 15)]
+        cue_starts.append(cue[0][0].start)
+        cue_ends.append(cue[-1][0].end)
+        durations = {}
+        for w, s in cue:
+            durations[s] = durations.get(s, 0) + w.end - w.start
+        expected.append(max(durations, key=durations.get))
+        i += len(cue)
+    return utterances, cue_starts, cue_ends, expected
+
+
+def run(hours: float, repeat: int) -> dict:
+    utterances, cue_starts, cue_ends, expected = synthetic_transcript(hours)
+    spans = speaker_spans(utterances)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        speakers = align_speakers(cue_starts, cue_ends, *spans)
+        timings.append(time.perf_counter() - start)
+    correct = sum(s == e for s, e in zip(speakers, expected))
+    best = min(timings)
+    return {
+        "hours": hours,
+        "num_cues": len(cue_starts),
+        "num_spans": len(spans[0]),
+        "best_secs": best,
+        "cues_per_sec": len(cue_starts) / best if best else None,
+        "accuracy": correct / len(expected) if expected else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps([run(h, args.repeat) for h in args.hours], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Offline calibration of the model cascade: runs the windowed combined analysis
+over synthetic recordings with the large model only, the small model only and the
+cascade at several escalation thresholds, and compares each run's agreement with
+the large-model baseline, its latency and its cost"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+# keep analyses from reading or filling the on-disk response cache
+os.environ.setdefault("LLM_CACHE_PATH", "")
+
+import metrics
+from analysis_runner import ANALYSIS_MODEL_ID, CASCADE_MODEL_ID, EMOTION_INTERVAL
+from benchmarks.fakes import FakeOpenAI, FakeSupabase, seed_couple
+from benchmarks.harness import drain_analysis_jobs
+from cascade import ModelCascade
+from chatbot import Chatbot, CombinedAnalysis, EmotionAnalysis, Interval
+from chatbot import ModeAnalysis, SecondaryToPrimaryMapping
+from llm_cache import LLMCache
+from store import DBClient
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def agreement(
+    baseline: dict[str, CombinedAnalysis], results: dict[str, CombinedAnalysis]
+) -> dict:
+    modes, emotions, primaries = [], [], []
+    for recording_id, expected in baseline.items():
+        actual = {
+            i.start_time: i
+            for i in results.get(recording_id, CombinedAnalysis(intervals=[])).intervals
+        }
+        for interval in expected.intervals:
+            other = actual.get(interval.start_time)
+            if other is None:
+                modes.append(0.0)
+                emotions.append(0.0)
+                primaries.append(0.0)
+                continue
+            modes.append(float(other.mode == interval.mode))
+            emotions.append(_jaccard(set(other.emotions), set(interval.emotions)))
+            primaries.append(
+                _jaccard(
+                    {SecondaryToPrimaryMapping[e] for e in other.emotions},
+                    {SecondaryToPrimaryMapping[e] for e in interval.emotions},
+                )
+            )
+    return {
+        "intervals": len(modes),
+        "mode_agreement": statistics.fmean(modes) if modes else None,
+        "emotion_jaccard": statistics.fmean(emotions) if emotions else None,
+        "primary_jaccard": statistics.fmean(primaries) if primaries else None,
+    }
+
+
+def stored_analyses(
+    db_client: DBClient, recording_ids: list[str]
+) -> dict[str, CombinedAnalysis]:
+    """Pairs each recording's stored mode and emotion intervals by start time"""
+    modes = db_client.get_mode_analyses(recording_ids)
+    emotions = db_client.get_emotion_analyses(recording_ids, EMOTION_INTERVAL)
+    rv = {}
+    for recording_id in recording_ids:
+        if recording_id not in modes or recording_id not in emotions:
+            continue
+        labels = {
+            e.start_time: e.labels
+            for e in EmotionAnalysis.model_validate(emotions[recording_id]).emotions
+        }
+        rv[recording_id] = CombinedAnalysis(
+            intervals=[
+                Interval(
+                    start_time=m.start_time,
+                    end_time=m.end_time,
+                    mode=m.label,
+                    emotions=labels.get(m.start_time, []),
+                    reasoning=m.reasoning,
+                )
+                for m in ModeAnalysis.model_validate(modes[recording_id]).modes
+            ]
+        )
+    return rv
+
+
+def _cost() -> float:
+    return sum(row["cost_usd"] for row in metrics.token_stats())
+
+
+def _escalations() -> tuple[int, int]:
+    rows = metrics.cascade_stats()
+    return (
+        sum(row["accepted"] for row in rows),
+        sum(row["escalated"] for row in rows),
+    )
+
+
+def run_pass(
+    name: str,
+    db: FakeSupabase,
+    db_client: DBClient,
+    recording_ids: list[str],
+    chatbot: Chatbot,
+    cascade: ModelCascade | None,
+    num_workers: int,
+) -> tuple[dict, dict[str, CombinedAnalysis]]:
+    # every pass analyzes from scratch rather than reusing stored results
+    for table in ("window_analysis", "mode_analysis", "emotion_analysis"):
+        db.tables.pop(table, None)
+    cost = _cost()
+    accepted, escalated = _escalations()
+    start = time.perf_counter()
+    timings, num_failed = drain_analysis_jobs(
+        db_client, chatbot, recording_ids, cascade, num_workers
+    )
+    wall = time.perf_counter() - start
+    accepted, escalated = (a - b for a, b in zip(_escalations(), (accepted, escalated)))
+    timings.sort()
+    summary = {
+        "run": name,
+        "recordings": len(recording_ids),
+        "errors": num_failed,
+        "wall_secs": wall,
+        "p50_ms": statistics.median(timings) * 1000 if timings else None,
+        "p95_ms": (
+            timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000
+            if timings
+            else None
+        ),
+        "cost_usd": _cost() - cost,
+        "escalation_rate": (
+            escalated / (accepted + escalated)
+            if cascade and accepted + escalated
+            else None
+        ),
+    }
+    return summary, stored_analyses(db_client, recording_ids)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recordings", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--small-latency", type=float, default=0.05)
+    parser.add_argument("--large-latency", type=float, default=0.2)
+    parser.add_argument("--small-error-rate", type=float, default=0.05)
+    parser.add_argument(
+        "--thresholds", type=float, nargs="+", default=[0.0, 0.1, 0.2, 0.3]
+    )
+    args = parser.parse_args()
+
+    db = FakeSupabase()
+    db_client = DBClient(db)
+    couple_id = seed_couple(db, args.recordings)
+    recording_ids = [
+        rec["id"]
+        for rec in db_client.get_recording_metadata(couple_id, 0, args.recordings)
+    ]
+    openai = FakeOpenAI(
+        model_latency={
+            CASCADE_MODEL_ID: args.small_latency,
+            ANALYSIS_MODEL_ID: args.large_latency,
+        },
+        model_errors={CASCADE_MODEL_ID: args.small_error_rate},
+    )
+    large = Chatbot(model_id=ANALYSIS_MODEL_ID, temperature=0.0, client=openai)
+    small = Chatbot(model_id=CASCADE_MODEL_ID, temperature=0.0, client=openai)
+
+    def run(name: str, chatbot: Chatbot, cascade: ModelCascade | None = None):
+        return run_pass(
+            name, db, db_client, recording_ids, chatbot, cascade, args.workers
+        )
+
+    baseline_summary, baseline = run("large_only", large)
+    runs = [(baseline_summary, baseline), run("small_only", small)]
+    for threshold in args.thresholds:
+        cascade = ModelCascade(
+            openai,
+            CASCADE_MODEL_ID,
+            ANALYSIS_MODEL_ID,
+            temperature=0.0,
+            max_inconsistent_share=threshold,
+            # a fresh cache so that no run reuses another's responses
+            cache=LLMCache(None),
+        )
+        runs.append(run(f"cascade_{threshold:g}", large, cascade))
+
+    print(
+        json.dumps(
+            {
+                "config": vars(args),
+                "results": [
+                    {
+                        **summary,
+                        "cost_vs_baseline": (
+                            summary["cost_usd"] / baseline_summary["cost_usd"]
+                            if baseline_summary["cost_usd"]
+                            else None
+                        ),
+                        **agreement(baseline, results),
+                    }
+                    for summary, results in runs
+                ],
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from typing import Callable
+
+# keep analyses from reading or filling the on-disk response cache
+os.environ.setdefault("LLM_CACHE_PATH", "")
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+import metrics
+from aggregation import mode_chart_data
+from analysis_runner import ANALYSIS_MODEL_ID, analysis_cascade
+from benchmarks.fakes import (
+    FakeOpenAI,
+    FakeSupabase,
+    FakeTranscriber,
+    seed_couple,
+    synthetic_transcript,
+)
+from benchmarks.harness import drain_analysis_jobs
+from catalog import RecordingCatalog
+from chatbot import Chatbot
+from chunked_transcription import CHUNK_SECS, OVERLAP_SECS, AudioChunk
+from chunked_transcription import ChunkedTranscriber
+from main import mode_analysis, process_vtt
+from store import DBClient
+
+BYTES_PER_SEC = 16000
+
+
+def timed(fn: Callable, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(stage: str, timings: list[float], items: int = 1, **extra) -> dict:
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        "stage": stage,
+        "runs": len(timings),
+        "p50_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "mean_ms": total / len(timings) * 1000,
+        "items_per_sec": items * len(timings) / total if total else None,
+        **extra,
+    }
+
+
+def bench_process_vtt(minutes: int, repeat: int) -> dict:
+    transcript = synthetic_transcript(minutes * 60000, random.Random(0))
+    vtt = transcript.export_subtitles_vtt()
+    return summarize(
+        "process_vtt",
+        timed(lambda: process_vtt(vtt, transcript.utterances), repeat),
+        minutes=minutes,
+    )
+
+
+def bench_transcribe(minutes: int, latency: float, repeat: int) -> dict:
+    chunk_len = CHUNK_SECS * BYTES_PER_SEC
+    total_len = minutes * 60 * BYTES_PER_SEC
+    chunks = [
+        AudioChunk(
+            index=i,
+            offset_ms=start * 1000 // BYTES_PER_SEC,
+            duration_ms=0,
+            data=bytes(
+                min(chunk_len + OVERLAP_SECS * BYTES_PER_SEC, total_len - start)
+            ),
+        )
+        for i, start in enumerate(range(0, total_len, chunk_len))
+    ]
+    transcriber = ChunkedTranscriber(FakeTranscriber(latency, BYTES_PER_SEC))
+    # a chunk the server failed must fail the whole transcription rather than
+    # leave a silent gap
+    failing = ChunkedTranscriber(
+        FakeTranscriber(latency, BYTES_PER_SEC, failed_calls={len(chunks) // 2})
+    )
+    try:
+        failing.transcribe(chunks)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("a failed chunk was transcribed as silence")
+    return summarize(
+        "transcribe",
+        timed(lambda: transcriber.transcribe(chunks), repeat),
+        minutes=minutes,
+        chunks=len(chunks),
+    )
+
+
+def bench_analysis(
+    catalog: RecordingCatalog, db_client: DBClient, num_workers: int
+) -> list[dict]:
+    rps = [rp for page in range(catalog.num_pages()) for rp in catalog.page(page)]
+    start = time.perf_counter()
+    timings, num_failed = drain_analysis_jobs(
+        db_client,
+        catalog.chatbot,
+        [rp.id for rp in rps],
+        cascade=analysis_cascade(catalog.chatbot),
+        num_workers=num_workers,
+    )
+    return [
+        summarize(
+            "analysis_jobs",
+            [time.perf_counter() - start],
+            items=len(rps),
+            recordings=len(rps),
+            errors=num_failed,
+        ),
+        summarize("analysis_job", timings, workers=num_workers),
+    ]
+
+
+def bench_mode_analysis(
+    catalog: RecordingCatalog, db_client: DBClient, repeat: int
+) -> list[dict]:
+    rps = catalog.page(0)
+    timestamps = {rp.id: rp.ts for rp in rps}
+
+    def prepare():
+        return mode_chart_data(
+            db_client.get_mode_analyses(list(timestamps)), timestamps
+        )
+
+    def prepare_cold():
+        st.cache_data.clear()
+        prepare()
+
+    st.session_state["db_client"] = db_client
+    st.session_state["catalog"] = catalog
+    st.session_state["rps"] = rps
+    return [
+        summarize("mode_data_cold", timed(prepare_cold, repeat), recordings=len(rps)),
+        summarize("mode_data_warm", timed(prepare, repeat), recordings=len(rps)),
+        # the full page: data preparation plus building and serializing the charts
+        summarize("mode_page", timed(mode_analysis, repeat), recordings=len(rps)),
+    ]
+
+
+def _dashboard_script():
+    import main
+
+    main.dashboard()
+
+
+def bench_dashboard(
+    catalog: RecordingCatalog, db_client: DBClient, couple_id: str, repeat: int
+) -> dict:
+    app = AppTest.from_function(_dashboard_script, default_timeout=60)
+    app.session_state["db_client"] = db_client
+    app.session_state["couple_id"] = couple_id
+    app.session_state["catalog"] = catalog
+    app.run()
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    return summarize(
+        "dashboard_rerun",
+        timed(app.run, repeat),
+        recordings=len(app.session_state["rps"]),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recordings", type=int, default=300)
+    parser.add_argument("--minutes", type=int, default=60)
+    parser.add_argument("--openai-latency", type=float, default=0.0)
+    parser.add_argument("--supabase-latency", type=float, default=0.0)
+    parser.add_argument("--transcriber-latency", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    db = FakeSupabase(args.supabase_latency)
+    openai = FakeOpenAI(args.openai_latency)
+    db_client = DBClient(db)
+    couple_id = seed_couple(db, args.recordings)
+    catalog = RecordingCatalog(
+        db_client,
+        couple_id,
+        Chatbot(model_id=ANALYSIS_MODEL_ID, temperature=0.0, client=openai),
+    )
+
+    results = [
+        bench_process_vtt(args.minutes, args.repeat),
+        bench_transcribe(args.minutes, args.transcriber_latency, args.repeat),
+        *bench_analysis(catalog, db_client, args.workers),
+        *bench_mode_analysis(catalog, db_client, args.repeat),
+        bench_dashboard(catalog, db_client, couple_id, args.repeat),
+    ]
+    print(
+        json.dumps(
+            {
+                "config": vars(args),
+                "openai_calls": openai.calls,
+                "results": results,
+                "operations": metrics.operation_stats(),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Runs the Zoom ingester against in-process S3, Zoom and Supabase stand-ins: a
+full ingest, a rerun that must skip everything without listing what it already
+knows, meetings ingested by older runs or other processes, and reruns after
+failures that must resume interrupted uploads (with and without Range support,
+and when every byte was already stored) without duplicating recordings"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Callable
+from benchmarks.fakes import FakeS3, FakeSupabase, FakeZoom, synthetic_transcript
+from ingest import AUDIO_NAME, INGESTED_PREFIX, PART_SIZE, RECORDING_ID_NAME
+from ingest import TRANSCRIPT_NAME, ZoomIngester, meeting_prefix
+from s3_index import S3KeyIndex
+from store import DBClient
+
+BUCKET = "bench"
+
+
+def fake_zoom(
+    num_meetings: int, audio_bytes: int, audio_share: float, ranges: bool = True
+) -> FakeZoom:
+    rng = random.Random(0)
+    meetings, transcripts, audio = [], {}, {}
+    for i in range(num_meetings):
+        meeting_id = str(i)
+        meetings.append(
+            {
+                "id": meeting_id,
+                "uuid": f"uuid-{i}",
+                "topic": f"Check-in {i}",
+                "start_time": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T20:00:00Z",
+            }
+        )
+        transcripts[meeting_id] = synthetic_transcript(
+            rng.randint(1, 5) * 60000, rng
+        ).export_subtitles_vtt()
+        if rng.random() < audio_share:
+            audio[meeting_id] = rng.randbytes(audio_bytes)
+    return FakeZoom(meetings, transcripts, audio, ranges=ranges)
+
+
+class Run:
+    def __init__(self, zoom: FakeZoom, tmp: str) -> None:
+        self.zoom = zoom
+        self.s3 = FakeS3()
+        self.db = FakeSupabase()
+        self.db_client = DBClient(self.db)
+        self.key_index = S3KeyIndex(
+            self.s3,
+            BUCKET,
+            path=os.path.join(tempfile.mkdtemp(dir=tmp), "index.sqlite3"),
+        )
+
+    def ingest(self, meetings: list[dict] | None = None, index: bool = True):
+        zoom = self.zoom
+        if meetings is not None:
+            # shares the files and download log, listing only these meetings
+            zoom = copy.copy(zoom)
+            zoom.meetings = meetings
+        ingester = ZoomIngester(
+            zoom,
+            self.s3,
+            self.db_client,
+            couple_id="couple",
+            bucket=BUCKET,
+            key_index=self.key_index if index else None,
+        )
+        start = time.perf_counter()
+        report = ingester.ingest(num_lookback_months=1)
+        return report, time.perf_counter() - start
+
+    def num_recordings(self) -> int:
+        return len(self.db.tables.get("recording", []))
+
+    def dated_by_meeting(self) -> bool:
+        dates = {row["created_at"] for row in self.db.tables.get("recording", [])}
+        return dates == {m["start_time"] for m in self.zoom.meetings}
+
+    def audio_intact(self) -> bool:
+        return all(
+            self.s3.objects[meeting_prefix(m) + AUDIO_NAME][0]
+            == self.zoom.files[f"audio/{m['id']}"]
+            for m in self.zoom.meetings
+            if f"audio/{m['id']}" in self.zoom.files
+        )
+
+
+def check_full_ingest(run: Run) -> dict:
+    report, wall = run.ingest()
+    return {
+        "wall_secs": wall,
+        "ingested": len(report.ingested),
+        "ok": not report.failed
+        and len(report.ingested) == len(run.zoom.meetings)
+        and run.num_recordings() == len(run.zoom.meetings)
+        and len(run.key_index.keys(INGESTED_PREFIX)) == len(run.zoom.meetings)
+        and run.audio_intact()
+        and run.dated_by_meeting(),
+    }
+
+
+def check_rerun_skips(run: Run) -> dict:
+    run.ingest()
+    # the first run's sync found nothing, so this one lists the markers once
+    run.ingest()
+    downloads = len(run.zoom.downloads)
+    listed = run.s3.listed
+    report, wall = run.ingest()
+    return {
+        "wall_secs": wall,
+        "skipped": len(report.skipped),
+        "listed": run.s3.listed - listed,
+        "ok": len(report.skipped) == len(run.zoom.meetings)
+        and len(run.zoom.downloads) == downloads
+        and run.s3.listed == listed
+        and run.num_recordings() == len(run.zoom.meetings),
+    }
+
+
+def check_legacy_markers(run: Run) -> dict:
+    """Meetings ingested before done markers existed, under other recording ids"""
+    for meeting in run.zoom.meetings:
+        prefix = meeting_prefix(meeting)
+        vtt = run.zoom.files[f"transcript/{meeting['id']}"]
+        run.s3.put_object(Bucket=BUCKET, Key=prefix + TRANSCRIPT_NAME, Body=vtt)
+        recording_id = run.db_client.insert_recording("couple", vtt.decode())
+        run.s3.put_object(
+            Bucket=BUCKET, Key=prefix + RECORDING_ID_NAME, Body=recording_id.encode()
+        )
+    report, wall = run.ingest()
+    rerun, _ = run.ingest()
+    return {
+        "wall_secs": wall,
+        "skipped": len(report.skipped),
+        "ok": len(report.skipped) == len(run.zoom.meetings)
+        and len(rerun.skipped) == len(run.zoom.meetings)
+        and not run.zoom.downloads
+        and run.num_recordings() == len(run.zoom.meetings),
+    }
+
+
+def check_keys_written_elsewhere(run: Run) -> dict:
+    """Ingests the first meeting without the index after the others were indexed;
+    its meeting prefix sorts before theirs"""
+    first, *rest = run.zoom.meetings
+    run.ingest(rest)
+    # the index has now listed the others' keys
+    run.ingest(rest)
+    run.ingest([first], index=False)
+    downloads = len(run.zoom.downloads)
+    report, wall = run.ingest()
+    return {
+        "wall_secs": wall,
+        "skipped": len(report.skipped),
+        "ok": len(report.skipped) == len(run.zoom.meetings)
+        and len(run.zoom.downloads) == downloads,
+    }
+
+
+def check_resume_after(
+    fault: str, calls: int, audio_status: int | None = None
+) -> Callable[[Run], dict]:
+    """Lets the first run fail on the call after `calls` successful calls of
+    `fault`, then checks that a second run finishes without duplicates and, given
+    audio_status, that it downloaded the audio again with that status"""
+
+    def check(run: Run) -> dict:
+        run.s3.faults[fault] = calls
+        first, _ = run.ingest()
+        downloads = len(run.zoom.downloads)
+        report, wall = run.ingest()
+        statuses = [
+            status
+            for url, status in run.zoom.downloads[downloads:]
+            if url.startswith("audio/")
+        ]
+        return {
+            "wall_secs": wall,
+            "failed_first": len(first.failed),
+            "audio_statuses": statuses,
+            "ok": len(first.failed) == 1
+            and not report.failed
+            and run.num_recordings() == len(run.zoom.meetings)
+            and run.audio_intact()
+            and (audio_status is None or statuses == [audio_status]),
+        }
+
+    return check
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--meetings", type=int, default=20)
+    parser.add_argument("--audio-mb", type=float, default=20)
+    parser.add_argument("--audio-share", type=float, default=0.7)
+    args = parser.parse_args()
+    audio_bytes = int(args.audio_mb * 1024 * 1024)
+    if audio_bytes <= PART_SIZE:
+        parser.error("--audio-mb must exceed one part for uploads to be resumable")
+
+    def many() -> FakeZoom:
+        return fake_zoom(args.meetings, audio_bytes, args.audio_share)
+
+    # a single meeting with audio uploads its transcript's only part and then
+    # the audio's parts, so faults can be aimed at the audio upload
+    def single(ranges: bool = True) -> FakeZoom:
+        return fake_zoom(1, audio_bytes, 1.0, ranges)
+
+    scenarios = [
+        ("full_ingest", many, check_full_ingest),
+        ("rerun_skips", many, check_rerun_skips),
+        ("keys_written_elsewhere", many, check_keys_written_elsewhere),
+        ("legacy_markers", many, check_legacy_markers),
+        # the recording is stored but its marker is not
+        ("crash_before_marker", many, check_resume_after("put_object", 0)),
+        # the audio's second part fails
+        ("resume_with_range", single, check_resume_after("upload_part", 2, 206)),
+        (
+            "resume_without_range",
+            lambda: single(ranges=False),
+            check_resume_after("upload_part", 2, 200),
+        ),
+        # every audio part is stored, so the ranged request is answered with 416
+        (
+            "resume_complete_upload",
+            single,
+            check_resume_after("complete_multipart_upload", 1, 416),
+        ),
+    ]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, zoom, check in scenarios:
+            results.append({"scenario": name, **check(Run(zoom(), tmp))})
+    print(json.dumps({"config": vars(args), "results": results}, indent=2))
+    if not all(r["ok"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
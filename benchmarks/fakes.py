@@ -0,0 +1,636 @@
+"""In-process stand-ins for the OpenAI, Supabase, AssemblyAI, S3 and Zoom clients,
+each with a configurable per-call latency"""
+
+import hashlib
+import io
+import itertools
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Iterable
+import assemblyai as aai
+from chatbot import Emotion, EmotionName, Interval, Mode, ModeName
+from chatbot import SecondaryToPrimaryMapping
+from chunked_transcription import Word, words_to_vtt
+from transcript import Transcript, format_timestamp, timestamp_ms
+
+STREAM_CHUNK_CHARS = 16
+INTERVAL = re.compile(r"every interval of (\d+) minutes")
+SCOPE = re.compile(r"from (\d\d:\d\d:\d\d) to (\d\d:\d\d:\d\d)")
+MARKER = re.compile(r"^\[(\d\d:\d\d:\d\d)\]$", re.MULTILINE)
+# share of a model's mislabelled intervals whose reasoning argues for the wrong
+# labels; the rest still describe what was actually said
+SILENT_ERROR_SHARE = 0.25
+# how a model might describe each mode and primary emotion, written as varied prose
+# rather than from the cascade's cue lists, so how many wrong labels the cascade
+# notices is measured by bench_cascade instead of being decided here
+MODE_DESCRIPTIONS = {
+    ModeName.conflict: (
+        "argue about chores",
+        "raise their voices over money",
+        "keep interrupting each other",
+        "trade accusations about being late",
+        "go quiet after a sharp remark",
+    ),
+    ModeName.support: (
+        "reassure each other",
+        "talk through a hard week at work",
+        "listen while one of them vents",
+        "offer to help with the move",
+        "check in on how the other is coping",
+    ),
+    ModeName.affection: (
+        "express their love",
+        "thank each other for the little things",
+        "reminisce about their first date",
+        "trade compliments",
+        "say how much they missed each other",
+    ),
+    ModeName.discussion: (
+        "discuss weekend plans",
+        "sort out the grocery list",
+        "compare calendars for next month",
+        "go over the bills",
+        "talk about a news story",
+    ),
+    ModeName.playful: (
+        "joke around",
+        "tease each other about cooking",
+        "make up silly nicknames",
+        "laugh at an old video",
+        "banter over a board game",
+    ),
+}
+EMOTION_DESCRIPTIONS = {
+    "happy": ("cheerful", "upbeat", "content"),
+    "sad": ("down", "withdrawn", "flat"),
+    "anger": ("irritated", "heated", "curt"),
+    "surprise": ("taken aback", "caught off guard"),
+    "disgust": ("put off", "dismissive"),
+    "fear": ("nervous", "uneasy", "on edge"),
+}
+
+
+def _sleep(latency: float) -> None:
+    if latency:
+        time.sleep(latency)
+
+
+def _seeded(text: str) -> random.Random:
+    return random.Random(hashlib.sha1(text.encode()).digest())
+
+
+def _reasoning(mode: ModeName, labels: list[EmotionName], rng: random.Random) -> str:
+    # an emotion is named about as often as it is only described
+    feelings = [
+        rng.choice((l.value, *EMOTION_DESCRIPTIONS[SecondaryToPrimaryMapping[l]]))
+        for l in labels
+    ]
+    return f"They {rng.choice(MODE_DESCRIPTIONS[mode])} and sound {', '.join(feelings)}"
+
+
+class FakeOpenAI:
+    """Answers structured-output parse requests with deterministic random labels
+    for every interval the prompt asks about, each with a reasoning phrased from
+    MODE_DESCRIPTIONS and EMOTION_DESCRIPTIONS. Models listed in model_errors
+    mislabel that share of intervals, mostly with reasoning that still describes
+    the right labels"""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        model_latency: dict[str, float] | None = None,
+        model_errors: dict[str, float] | None = None,
+    ) -> None:
+        self.latency = latency
+        self.model_latency = model_latency or {}
+        self.model_errors = model_errors or {}
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.beta = SimpleNamespace(
+            chat=SimpleNamespace(
+                completions=SimpleNamespace(parse=self.parse, stream=self.stream)
+            )
+        )
+
+    def parse(self, model: str, messages: list[dict], response_format, **kwargs):
+        _sleep(self.model_latency.get(model, self.latency))
+        with self.lock:
+            self.calls += 1
+        prompt = "\n".join(m["content"] for m in messages)
+        interval_ms = int(INTERVAL.search(prompt).group(1)) * 60000
+        scope = SCOPE.search(prompt)
+        if scope:
+            start_ms, end_ms = (timestamp_ms(t) for t in scope.groups())
+        else:
+            markers = MARKER.findall(prompt)
+            end_ms = timestamp_ms(markers[-1]) + interval_ms if markers else 0
+            start_ms = 0
+        rng = _seeded(prompt)
+        error_rate = self.model_errors.get(model, 0.0)
+        errors = _seeded(model + prompt)
+        phrasing = _seeded("reasoning" + model + prompt)
+        items = []
+        for t in range(start_ms // interval_ms * interval_ms, end_ms, interval_ms):
+            labels = rng.sample(list(EmotionName), rng.randint(1, 3))
+            mode = rng.choice(list(ModeName))
+            reasoning = _reasoning(mode, labels, phrasing)
+            if error_rate and errors.random() < error_rate:
+                mode = errors.choice([m for m in ModeName if m != mode])
+                labels = errors.sample(list(EmotionName), len(labels))
+                if errors.random() < SILENT_ERROR_SHARE:
+                    reasoning = _reasoning(mode, labels, phrasing)
+            times = {
+                "start_time": format_timestamp(t, False),
+                "end_time": format_timestamp(t + interval_ms, False),
+                "reasoning": reasoning,
+            }
+            if "intervals" in response_format.model_fields:
+                items.append(Interval(mode=mode, emotions=labels, **times))
+            elif "emotions" in response_format.model_fields:
+                items.append(Emotion(labels=labels, **times))
+            else:
+                items.append(Mode(label=mode, **times))
+        field = next(iter(response_format.model_fields))
+        parsed = response_format(**{field: items})
+        usage = SimpleNamespace(
+            prompt_tokens=len(prompt) // 4,
+            completion_tokens=len(items) * 20,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+        )
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(parsed=parsed))],
+            usage=usage,
+        )
+
+    @contextmanager
+    def stream(self, model: str, messages: list[dict], response_format, **kwargs):
+        """Streams the parse response back as content deltas of STREAM_CHUNK_CHARS"""
+        yield FakeStream(self.parse(model, messages, response_format, **kwargs))
+
+
+class FakeStream:
+    def __init__(self, completion) -> None:
+        self.completion = completion
+
+    def __iter__(self):
+        content = self.completion.choices[0].message.parsed.model_dump_json()
+        for i in range(0, len(content), STREAM_CHUNK_CHARS):
+            yield SimpleNamespace(
+                type="content.delta", delta=content[i : i + STREAM_CHUNK_CHARS]
+            )
+
+    def get_final_completion(self):
+        return self.completion
+
+
+class FakeQuery:
+    def __init__(self, db: "FakeSupabase", table: str) -> None:
+        self.db = db
+        self.table = table
+        self.filters = []
+        self.action = "select"
+        self.columns = None
+        self.payload = None
+        self.on_conflict = None
+        self.count = None
+        self.head = False
+        self.order_by = None
+        self.bounds = None
+        self.single = False
+
+    def select(self, columns: str = "*", count: str | None = None, head=False):
+        self.columns = (
+            None if columns == "*" else [c.strip() for c in columns.split(",")]
+        )
+        self.count = count
+        self.head = head
+        return self
+
+    def eq(self, column: str, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column: str, values: Iterable):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def or_(self, expression: str):
+        clauses = [c.split(".eq.") for c in expression.split(",")]
+        self.filters.append(lambda row: any(str(row.get(k)) == v for k, v in clauses))
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self.order_by = (column, desc)
+        return self
+
+    def range(self, start: int, end: int):
+        self.bounds = (start, end + 1)
+        return self
+
+    def limit(self, n: int):
+        self.bounds = (0, n)
+        return self
+
+    def maybe_single(self):
+        self.single = True
+        return self
+
+    def insert(self, payload):
+        self.action, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload, on_conflict: str = "id"):
+        self.action, self.payload = "upsert", payload
+        self.on_conflict = on_conflict.split(",")
+        return self
+
+    def update(self, payload: dict):
+        self.action, self.payload = "update", payload
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def execute(self):
+        _sleep(self.db.latency)
+        with self.db.lock:
+            rows = self.db.tables.setdefault(self.table, [])
+            match self.action:
+                case "select":
+                    return self._select(rows)
+                case "insert":
+                    return SimpleNamespace(
+                        data=self.db.insert(self.table, self.payload)
+                    )
+                case "upsert":
+                    return SimpleNamespace(data=self._upsert(rows))
+                case "update":
+                    matched = [r for r in rows if all(f(r) for f in self.filters)]
+                    for row in matched:
+                        row.update(self.payload)
+                    return SimpleNamespace(data=[dict(r) for r in matched])
+                case "delete":
+                    matched = [r for r in rows if all(f(r) for f in self.filters)]
+                    rows[:] = [r for r in rows if r not in matched]
+                    return SimpleNamespace(data=[dict(r) for r in matched])
+
+    def _select(self, rows: list[dict]):
+        matched = [r for r in rows if all(f(r) for f in self.filters)]
+        count = len(matched)
+        if self.order_by:
+            column, desc = self.order_by
+            matched.sort(key=lambda r: r[column], reverse=desc)
+        if self.bounds:
+            matched = matched[self.bounds[0] : self.bounds[1]]
+        if self.columns:
+            matched = [{c: r.get(c) for c in self.columns} for r in matched]
+        else:
+            matched = [dict(r) for r in matched]
+        if self.single:
+            return SimpleNamespace(data=matched[0], count=count) if matched else None
+        return SimpleNamespace(data=[] if self.head else matched, count=count)
+
+    def _upsert(self, rows: list[dict]) -> list[dict]:
+        payload = self.payload if isinstance(self.payload, list) else [self.payload]
+        index = {tuple(r.get(c) for c in self.on_conflict): r for r in rows}
+        rv = []
+        for new in payload:
+            existing = index.get(tuple(new.get(c) for c in self.on_conflict))
+            if existing:
+                existing.update(new)
+                rv.append(dict(existing))
+            else:
+                rv.extend(self.db.insert(self.table, new))
+        return rv
+
+
+class FakeSupabase:
+    """Keeps every table as a list of row dicts and evaluates the subset of the
+    PostgREST query builder that DBClient uses"""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.tables = {}
+        self.lock = threading.RLock()
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def insert(self, table: str, payload) -> list[dict]:
+        payload = payload if isinstance(payload, list) else [payload]
+        rows = []
+        for row in payload:
+            row = {"id": str(uuid.uuid4()), **row}
+            row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+            self.tables.setdefault(table, []).append(row)
+            rows.append(dict(row))
+        return rows
+
+
+class FakeS3:
+    """Keeps objects and multipart uploads in memory and answers the subset of the
+    boto3 S3 client that ingestion and S3KeyIndex use. faults maps an operation
+    name to how many more calls succeed before one raises ConnectionError, to
+    interrupt a run part way. listed counts the objects returned by listings"""
+
+    def __init__(self, latency: float = 0.0, page_size: int = 1000) -> None:
+        self.latency = latency
+        self.page_size = page_size
+        self.objects = {}
+        self.uploads = {}
+        self.faults = {}
+        self.listed = 0
+        self.lock = threading.Lock()
+
+    def _call(self, operation: str) -> None:
+        _sleep(self.latency)
+        remaining = self.faults.get(operation)
+        if remaining is None:
+            return
+        if remaining:
+            self.faults[operation] = remaining - 1
+            return
+        del self.faults[operation]
+        raise ConnectionError(f"injected {operation} failure")
+
+    def _store(self, key: str, data: bytes) -> None:
+        self.objects[key] = (data, datetime.now(timezone.utc))
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes) -> dict:
+        with self.lock:
+            self._call("put_object")
+            self._store(Key, bytes(Body))
+        return {}
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        with self.lock:
+            self._call("get_object")
+            return {"Body": io.BytesIO(self.objects[Key][0])}
+
+    def create_multipart_upload(self, Bucket: str, Key: str) -> dict:
+        with self.lock:
+            self._call("create_multipart_upload")
+            upload_id = str(uuid.uuid4())
+            self.uploads[upload_id] = {"Key": Key, "Parts": {}}
+        return {"UploadId": upload_id}
+
+    def list_multipart_uploads(self, Bucket: str, Prefix: str = "") -> dict:
+        with self.lock:
+            self._call("list_multipart_uploads")
+            return {
+                "Uploads": [
+                    {"Key": u["Key"], "UploadId": upload_id}
+                    for upload_id, u in self.uploads.items()
+                    if u["Key"].startswith(Prefix)
+                ]
+            }
+
+    def upload_part(
+        self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes
+    ) -> dict:
+        with self.lock:
+            self._call("upload_part")
+            etag = hashlib.md5(Body).hexdigest()
+            self.uploads[UploadId]["Parts"][PartNumber] = (etag, bytes(Body))
+        return {"ETag": etag}
+
+    def complete_multipart_upload(
+        self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict
+    ) -> dict:
+        with self.lock:
+            self._call("complete_multipart_upload")
+            parts = self.uploads[UploadId]["Parts"]
+            data = b""
+            for part in MultipartUpload["Parts"]:
+                etag, body = parts[part["PartNumber"]]
+                assert etag == part["ETag"], "part was replaced"
+                data += body
+            del self.uploads[UploadId]
+            self._store(Key, data)
+        return {}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> dict:
+        with self.lock:
+            self._call("abort_multipart_upload")
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def get_paginator(self, operation: str) -> SimpleNamespace:
+        return SimpleNamespace(
+            paginate=lambda **kwargs: getattr(self, f"_paginate_{operation}")(**kwargs)
+        )
+
+    def _paginate_list_parts(self, Bucket: str, Key: str, UploadId: str):
+        with self.lock:
+            parts = [
+                {"PartNumber": n, "ETag": etag, "Size": len(body)}
+                for n, (etag, body) in sorted(self.uploads[UploadId]["Parts"].items())
+            ]
+        for i in range(0, len(parts), self.page_size):
+            yield {"Parts": parts[i : i + self.page_size]}
+
+    def _paginate_list_objects_v2(
+        self, Bucket: str, Prefix: str = "", StartAfter: str = ""
+    ):
+        with self.lock:
+            self._call("list_objects_v2")
+            contents = [
+                {"Key": key, "Size": len(data), "LastModified": modified}
+                for key, (data, modified) in sorted(self.objects.items())
+                if key.startswith(Prefix) and key > StartAfter
+            ]
+            self.listed += len(contents)
+        for i in range(0, max(1, len(contents)), self.page_size):
+            yield {"Contents": contents[i : i + self.page_size]}
+
+
+class FakeDownload:
+    def __init__(self, data: bytes, headers: dict, ranges: bool) -> None:
+        self.status_code = 200
+        self.data = data
+        offset = re.match(r"bytes=(\d+)-", headers.get("Range", ""))
+        if offset and ranges:
+            start = int(offset.group(1))
+            self.status_code = 416 if start >= len(data) else 206
+            self.data = data[start:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise ConnectionError(f"HTTP {self.status_code}")
+
+    def iter_content(self, chunk_size: int):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i : i + chunk_size]
+
+
+class FakeZoom:
+    """Serves meetings' transcript and audio files through a requests-like session
+    that honours Range headers unless ranges is False, and records the status of
+    every download. Meetings without an entry in audio have no audio-only file"""
+
+    def __init__(
+        self,
+        meetings: list[dict],
+        transcripts: dict[str, str],
+        audio: dict[str, bytes],
+        ranges: bool = True,
+        latency: float = 0.0,
+    ) -> None:
+        self.meetings = meetings
+        self.files = {f"transcript/{k}": v.encode() for k, v in transcripts.items()}
+        self.files.update({f"audio/{k}": v for k, v in audio.items()})
+        self.ranges = ranges
+        self.latency = latency
+        self.downloads = []
+        self.session = SimpleNamespace(get=self.get)
+
+    def iter_recordings(self, num_lookback_months: int):
+        yield from self.meetings
+
+    def get_transcript_download_url(self, meeting_id) -> str:
+        return f"transcript/{meeting_id}"
+
+    def get_audio_download_url(self, meeting_id) -> str:
+        url = f"audio/{meeting_id}"
+        if url not in self.files:
+            # ZoomClient finds no audio_only file
+            raise IndexError(url)
+        return url
+
+    def get(self, url: str, headers: dict | None = None, **kwargs) -> FakeDownload:
+        _sleep(self.latency)
+        response = FakeDownload(self.files[url], headers or {}, self.ranges)
+        self.downloads.append((url, response.status_code))
+        return response
+
+
+class FakeTranscriber:
+    """Returns a two-speaker transcript of random words covering the submitted audio,
+    whose length is taken from the chunk size at bytes_per_sec. The calls numbered
+    in failed_calls come back as jobs the server failed, like AssemblyAI's do"""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        bytes_per_sec: int = 16000,
+        failed_calls: set[int] | None = None,
+    ) -> None:
+        self.latency = latency
+        self.bytes_per_sec = bytes_per_sec
+        self.failed_calls = failed_calls or set()
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def transcribe(self, audio) -> SimpleNamespace:
+        _sleep(self.latency)
+        with self.lock:
+            call = self.calls
+            self.calls += 1
+        if call in self.failed_calls:
+            return SimpleNamespace(
+                status=aai.TranscriptStatus.error,
+                error="injected transcription failure",
+                utterances=None,
+            )
+        data = audio.read() if hasattr(audio, "read") else audio
+        duration_ms = len(data) * 1000 // self.bytes_per_sec
+        return synthetic_transcript(duration_ms, _seeded(str(len(data))))
+
+
+def synthetic_transcript(duration_ms: int, rng: random.Random) -> SimpleNamespace:
+    utterances = []
+    t = 0
+    for speaker in itertools.cycle("AB"):
+        if t >= duration_ms:
+            break
+        words = []
+        for _ in range(rng.randint(3, 40)):
+            start = t + rng.randint(0, 200)
+            end = start + rng.randint(150, 600)
+            if end > duration_ms:
+                break
+            words.append(
+                SimpleNamespace(text=f"w{rng.randint(0, 999)}", start=start, end=end)
+            )
+            t = end
+        if words:
+            utterances.append(
+                SimpleNamespace(
+                    speaker=speaker,
+                    start=words[0].start,
+                    end=words[-1].end,
+                    text=" ".join(w.text for w in words),
+                    words=words,
+                )
+            )
+        t += rng.randint(100, 1500)
+    return SimpleNamespace(
+        status=aai.TranscriptStatus.completed,
+        error=None,
+        utterances=utterances,
+        export_subtitles_vtt=lambda: _captions_vtt(utterances, rng),
+    )
+
+
+def _captions_vtt(utterances: list, rng: random.Random) -> str:
+    """Cuts captions from the word stream regardless of utterance boundaries, like
+    AssemblyAI's own subtitle export"""
+    words = [w for u in utterances for w in u.words]
+    cues = []
+    i = 0
+    while i < len(words):
+        cue = words[i : i + rng.randint(5, 15)]
+        cues.append(
+            f"{format_timestamp(cue[0].start)} --> {format_timestamp(cue[-1].end)}\n"
+            + " ".join(w.text for w in cue)
+        )
+        i += len(cue)
+    return "WEBVTT\n\n" + "\n\n".join(cues)
+
+
+def seed_couple(
+    db: FakeSupabase,
+    num_recordings: int,
+    minutes: tuple[int, int] = (20, 60),
+    seed: int = 0,
+) -> str:
+    """Creates two users' couple row and num_recordings recordings with synthetic
+    speaker-labelled transcripts spread over the past year"""
+    rng = random.Random(seed)
+    couple_id = db.insert(
+        "couple", {"user_id": str(uuid.uuid4()), "partner_id": str(uuid.uuid4())}
+    )[0]["id"]
+    now = datetime.now(timezone.utc)
+    for i in range(num_recordings):
+        transcript = synthetic_transcript(rng.randint(*minutes) * 60000, rng)
+        vtt = words_to_vtt(
+            [
+                Word(w.text, w.start, w.end, u.speaker)
+                for u in transcript.utterances
+                for w in u.words
+            ]
+        )
+        db.insert(
+            "recording",
+            {
+                "couple_id": couple_id,
+                "transcript": vtt,
+                "transcript_compact": Transcript.from_vtt(vtt).encode(),
+                "created_at": (now - timedelta(days=i)).isoformat(),
+            },
+        )
+    return couple_id
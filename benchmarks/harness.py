@@ -0,0 +1,45 @@
+import os
+import tempfile
+import time
+from analysis_runner import enqueue_recording_analysis, run_analysis_job
+from cascade import ModelCascade
+from chatbot import Chatbot
+from jobs import JOB_FAILED, Job, SQLiteJobQueue, WorkerPool
+from store import DBClient
+
+
+def drain_analysis_jobs(
+    db_client: DBClient,
+    chatbot: Chatbot,
+    recording_ids: list[str],
+    cascade: ModelCascade | None = None,
+    num_workers: int = 4,
+) -> tuple[list[float], int]:
+    """Enqueues analysis of recording_ids in a throwaway queue and runs it through
+    a WorkerPool and run_analysis_job, as the app does, until no job is open.
+    Returns each job's duration in seconds and the number of failed jobs"""
+    timings = []
+
+    def handle(job: Job) -> None:
+        start = time.perf_counter()
+        try:
+            run_analysis_job(job, db_client, chatbot, cascade)
+        finally:
+            timings.append(time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SQLiteJobQueue(os.path.join(tmp, "jobs.sqlite3"))
+        for recording_id in recording_ids:
+            enqueue_recording_analysis(queue, recording_id)
+        pool = WorkerPool(
+            queue, handle, num_workers=num_workers, poll_secs=0.01, max_attempts=1
+        )
+        pool.start()
+        while queue.num_open():
+            time.sleep(0.01)
+        pool.stop()
+        num_failed = queue.db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_FAILED,)
+        ).fetchone()[0]
+        queue.db.close()
+    return timings, num_failed
@@ -0,0 +1,132 @@
+import re
+from openai import ContentFilterFinishReasonError, LengthFinishReasonError, OpenAI
+from pydantic import BaseModel, ValidationError
+from chatbot import EmotionName, ModeName, SecondaryToPrimaryMapping
+from llm_cache import LLMCache, cached_parse
+from metrics import record_cascade
+from prompt_encoding import timeline_mismatches
+
+# share of a response's intervals whose labels may disagree with their reasoning
+# before the large model is asked instead. At 0.0 a single mismatched interval
+# re-asks the whole window: the consistency check only catches part of the small
+# model's mistakes, so every one it does catch is taken as a sign that the window
+# holds others. In bench_cascade any higher share escalates fewer windows but
+# gives back most of the agreement the cascade adds over the small model alone
+MAX_INCONSISTENT_SHARE = 0.0
+
+# word stems that a reasoning describing each mode tends to use
+MODE_CUES: dict[ModeName, tuple[str, ...]] = {
+    ModeName.conflict: ("argu", "conflict", "disagree", "tension", "blam", "defensive"),
+    ModeName.support: ("support", "reassur", "comfort", "encourag", "empath"),
+    ModeName.affection: ("affection", "love", "tender", "appreciat", "warmth"),
+    ModeName.discussion: ("discuss", "plan", "logistic", "neutral", "inform"),
+    ModeName.playful: ("play", "joke", "laugh", "teas", "humor"),
+}
+_MODE_CUES = {
+    mode: re.compile(r"\b(?:" + "|".join(stems) + ")")
+    for mode, stems in MODE_CUES.items()
+}
+_EMOTION_WORDS = re.compile(r"\b(" + "|".join(e.value for e in EmotionName) + r")\b")
+
+
+def mode_consistent(label: ModeName, reasoning: str) -> bool:
+    """False when the reasoning describes some other mode and never its own"""
+    reasoning = reasoning.lower()
+    cued = {mode for mode, cues in _MODE_CUES.items() if cues.search(reasoning)}
+    return not cued or label in cued
+
+
+def emotions_consistent(labels: list[EmotionName], reasoning: str) -> bool:
+    """False when the reasoning names emotions none of whose primary emotions is
+    among the labels'"""
+    named = {
+        SecondaryToPrimaryMapping[EmotionName(e)]
+        for e in _EMOTION_WORDS.findall(reasoning.lower())
+    }
+    return not named or bool(named & {SecondaryToPrimaryMapping[e] for e in labels})
+
+
+def item_consistent(item: BaseModel) -> bool:
+    mode = getattr(item, "mode", None) or getattr(item, "label", None)
+    if mode is not None and not mode_consistent(mode, item.reasoning):
+        return False
+    labels = getattr(item, "emotions", None) or getattr(item, "labels", None)
+    if labels is not None and not emotions_consistent(labels, item.reasoning):
+        return False
+    return True
+
+
+class ModelCascade:
+    """Answers structured-output requests with a small model first and asks the
+    large model only when the small model's response fails validation or its
+    labels disagree with its own reasoning"""
+
+    def __init__(
+        self,
+        client: OpenAI,
+        small_model: str,
+        large_model: str,
+        temperature: float | None = None,
+        max_inconsistent_share: float = MAX_INCONSISTENT_SHARE,
+        cache: LLMCache | None = None,
+    ) -> None:
+        self.client = client
+        self.small_model = small_model
+        self.large_model = large_model
+        self.temperature = temperature
+        self.max_inconsistent_share = max_inconsistent_share
+        self.cache = cache
+
+    @property
+    def name(self) -> str:
+        return f"{self.small_model}>{self.large_model}"
+
+    def escalation_reason(
+        self, result: BaseModel | None, field: str, boundaries: set[int]
+    ) -> str | None:
+        if result is None:
+            return "refused"
+        items = getattr(result, field)
+        if not items and boundaries:
+            return "empty"
+        if timeline_mismatches(items, boundaries):
+            return "timeline"
+        inconsistent = sum(not item_consistent(item) for item in items)
+        if items and inconsistent / len(items) > self.max_inconsistent_share:
+            return "inconsistent"
+        return None
+
+    def _parse(self, model: str, messages: list[dict], response_format, **kwargs):
+        return cached_parse(
+            self.client,
+            model=model,
+            messages=messages,
+            response_format=response_format,
+            temperature=self.temperature,
+            cache=self.cache,
+            **kwargs,
+        )
+
+    def parse(
+        self,
+        messages: list[dict],
+        response_format: type[BaseModel],
+        field: str,
+        boundaries: set[int],
+        operation: str = "parse",
+        recording_id: str | None = None,
+    ) -> BaseModel:
+        kwargs = {"operation": operation, "recording_id": recording_id}
+        try:
+            result = self._parse(self.small_model, messages, response_format, **kwargs)
+            reason = self.escalation_reason(result, field, boundaries)
+        except (
+            ValidationError,
+            LengthFinishReasonError,
+            ContentFilterFinishReasonError,
+        ):
+            reason = "invalid"
+        record_cascade(operation, reason or "accepted", recording_id)
+        if reason is None:
+            return result
+        return self._parse(self.large_model, messages, response_format, **kwargs)
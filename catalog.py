@@ -0,0 +1,86 @@
+import time
+from chatbot import Chatbot
+from recording_processor import RecordingProcessor
+from store import DBClient
+
+DEFAULT_PAGE_SIZE = 50
+# cached pages are also dropped after this long, whatever the recording count says
+DEFAULT_TTL_SECS = 300
+
+
+class RecordingCatalog:
+    """Pages through a couple's recording metadata and hands out processors that
+    load their transcripts only when an analysis needs them"""
+
+    def __init__(
+        self,
+        db_client: DBClient,
+        couple_id: str,
+        chatbot: Chatbot,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        ttl_secs: float = DEFAULT_TTL_SECS,
+    ) -> None:
+        self.db_client = db_client
+        self.couple_id = couple_id
+        self.chatbot = chatbot
+        self.page_size = page_size
+        self.ttl_secs = ttl_secs
+        self.pages = {}
+        self.processors = {}
+        self.count = None
+        self.timestamps = None
+        self.loaded_at = time.monotonic()
+
+    def num_recordings(self) -> int:
+        if self.count is None:
+            self.count = self.db_client.count_recordings(self.couple_id)
+        return self.count
+
+    def num_pages(self) -> int:
+        return max(1, -(-self.num_recordings() // self.page_size))
+
+    def page(self, page: int) -> list[RecordingProcessor]:
+        if page not in self.pages:
+            self.pages[page] = self.db_client.get_recording_metadata(
+                self.couple_id, page * self.page_size, self.page_size
+            )
+        return [self._processor(rec) for rec in self.pages[page]]
+
+    def all_timestamps(self) -> dict[str, str]:
+        """created_at of every recording of the couple, from metadata only"""
+        if self.timestamps is None:
+            timestamps = {}
+            for page in range(self.num_pages()):
+                timestamps.update(
+                    (rec["id"], rec["created_at"])
+                    for rec in self.db_client.get_recording_metadata(
+                        self.couple_id, page * self.page_size, self.page_size
+                    )
+                )
+            self.timestamps = timestamps
+        return self.timestamps
+
+    def invalidate(self) -> None:
+        self.pages = {}
+        self.count = None
+        self.timestamps = None
+        self.loaded_at = time.monotonic()
+
+    def refresh(self) -> None:
+        """Drops cached pages when recordings were added or removed elsewhere, e.g.
+        by the partner or the ingester, or when they are older than ttl_secs"""
+        count = self.db_client.count_recordings(self.couple_id)
+        if count != self.count or time.monotonic() - self.loaded_at > self.ttl_secs:
+            self.invalidate()
+            self.count = count
+
+    def _processor(self, rec: dict) -> RecordingProcessor:
+        if rec["id"] not in self.processors:
+            self.processors[rec["id"]] = RecordingProcessor(
+                id=rec["id"],
+                ts=rec["created_at"],
+                transcript=None,
+                chatbot=self.chatbot,
+                db_client=self.db_client,
+            )
+        return self.processors[rec["id"]]
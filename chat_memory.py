@@ -0,0 +1,78 @@
+from typing import Callable
+from prompt_encoding import num_tokens
+
+# recent turns kept verbatim; older ones are folded into the summary
+RECENT_TOKEN_BUDGET = 2000
+# rough ratio used when tiktoken cannot load its vocabulary
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text: str, model: str) -> int:
+    tokens = num_tokens(text, model)
+    if tokens is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return tokens
+
+
+class ChatMemory:
+    """Conversation memory that keeps the latest turns verbatim within a token
+    budget and rolls everything older into a running summary, so the prompt a
+    turn sends stays the same size however long the conversation gets"""
+
+    def __init__(
+        self,
+        model: str,
+        summary: str = "",
+        turns: list[dict] | None = None,
+        recent_token_budget: int = RECENT_TOKEN_BUDGET,
+    ) -> None:
+        self.model = model
+        self.summary = summary
+        self.turns = turns or []
+        self.recent_token_budget = recent_token_budget
+        self.turn_tokens = [self._tokens(t) for t in self.turns]
+
+    def _tokens(self, turn: dict) -> int:
+        return count_tokens(turn["content"], self.model)
+
+    def add(self, role: str, content: str) -> None:
+        turn = {"role": role, "content": content}
+        self.turns.append(turn)
+        self.turn_tokens.append(self._tokens(turn))
+
+    def recent_tokens(self) -> int:
+        return sum(self.turn_tokens)
+
+    def overflow(self) -> list[dict]:
+        """Removes and returns the oldest turns until the rest fit the budget,
+        always keeping the latest exchange"""
+        n = 0
+        tokens = self.recent_tokens()
+        while tokens > self.recent_token_budget and n < len(self.turns) - 2:
+            tokens -= self.turn_tokens[n]
+            n += 1
+        old = self.turns[:n]
+        del self.turns[:n]
+        del self.turn_tokens[:n]
+        return old
+
+    def fold(self, summarize: Callable[[str, list[dict]], str]) -> bool:
+        """Summarizes the turns that no longer fit into the running summary and
+        returns whether there were any"""
+        old = self.overflow()
+        if old:
+            self.summary = summarize(self.summary, old)
+        return bool(old)
+
+    def to_dict(self) -> dict:
+        return {"summary": self.summary, "turns": self.turns}
+
+    @classmethod
+    def from_dict(cls, model: str, data: dict | None, **kwargs) -> "ChatMemory":
+        data = data or {}
+        return cls(
+            model,
+            summary=data.get("summary", ""),
+            turns=list(data.get("turns", [])),
+            **kwargs,
+        )
@@ -1,19 +1,19 @@
 from langchain_community.callbacks.manager import get_openai_callback
 from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from langchain.prompts.prompt import PromptTemplate
-from langchain.callbacks.base import BaseCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 import streamlit as st
 from pydantic import BaseModel, Field
 from enum import Enum
 from collections import defaultdict
+from functools import cached_property
+from openai import OpenAI
+from clients import get_registry
+from metrics import instrument
+from chat_memory import ChatMemory
 
-PROMPT_TEMPLATE = """
-Current conversation: {history}
-Human: {input}
-AI:
-"""
+SYSTEM_PROMPT = "You are a helpful assistant for a couple reflecting on their recorded conversations."
+SUMMARY_PROMPT = "Update the summary of the conversation so far with the new turns below, keeping facts, names and open questions. Reply with the summary only."
+SUMMARY_MAX_TOKENS = 400
 
 
 class EmotionName(str, Enum):
@@ -141,10 +141,55 @@ class ModeAnalysis(BaseModel):
     modes: list[Mode] = Field(description="mode detected every specified interval")
 
 
+class Interval(BaseModel):
+    start_time: str = Field(description="Start time of the interval")
+    end_time: str = Field(description="End time of the interval")
+    mode: ModeName = Field(description="mode label detected")
+    emotions: list[EmotionName] = Field(description="Emotion labels detected")
+    reasoning: str = Field(description="short description of reasoning")
+
+
+class CombinedAnalysis(BaseModel):
+    """Mode and emotion analysis in the transcript of a conversation between a couple"""
+
+    intervals: list[Interval] = Field(
+        description="mode and emotions detected every specified interval"
+    )
+
+    def mode_analysis(self) -> ModeAnalysis:
+        return ModeAnalysis(
+            modes=[
+                Mode(
+                    start_time=i.start_time,
+                    end_time=i.end_time,
+                    label=i.mode,
+                    reasoning=i.reasoning,
+                )
+                for i in self.intervals
+            ]
+        )
+
+    def emotion_analysis(self) -> EmotionAnalysis:
+        return EmotionAnalysis(
+            emotions=[
+                Emotion(
+                    start_time=i.start_time,
+                    end_time=i.end_time,
+                    labels=i.emotions,
+                    reasoning=i.reasoning,
+                )
+                for i in self.intervals
+            ]
+        )
+
+
 class Chatbot:
-    def __init__(self, model_id: str, temperature: float) -> None:
+    def __init__(
+        self, model_id: str, temperature: float, client: OpenAI | None = None
+    ) -> None:
         self.model_id = model_id
         self.temperature = temperature
+        self.client = client or get_registry().openai()
         self.num_tokens = 0
         self.num_tokens_delta = 0
 
@@ -154,14 +199,76 @@ class Chatbot:
 
 class OpenAIChatbot(Chatbot):
 
-    def __init__(self, model_id: str, temperature: float) -> None:
-        super().__init__(model_id=model_id, temperature=temperature)
-        self.llm = ChatOpenAI(
-            model_name=self.model_id, temperature=self.temperature, streaming=True
+    def __init__(
+        self,
+        model_id: str,
+        temperature: float,
+        client: OpenAI | None = None,
+        memory: ChatMemory | None = None,
+    ) -> None:
+        super().__init__(model_id=model_id, temperature=temperature, client=client)
+        self.memory = memory or ChatMemory(model_id)
+
+    @cached_property
+    def llm(self) -> ChatOpenAI:
+        return ChatOpenAI(
+            model_name=self.model_id,
+            temperature=self.temperature,
+            streaming=True,
+            stream_usage=True,
+            # shares the app's OpenAI client and its connection pool
+            client=self.client.chat.completions,
+            root_client=self.client,
         )
-        PROMPT = PromptTemplate(
-            input_variables=["history", "input"], template=PROMPT_TEMPLATE
+
+    @cached_property
+    def summary_llm(self) -> ChatOpenAI:
+        return ChatOpenAI(
+            model_name=self.model_id,
+            temperature=0.0,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            stream_usage=True,
+            client=self.client.chat.completions,
+            root_client=self.client,
         )
-        self.chain = ConversationChain(
-            prompt=PROMPT, llm=self.llm, memory=ConversationBufferMemory(), verbose=True
+
+    def _invoke(self, operation: str, llm: ChatOpenAI, messages: list) -> str:
+        with instrument("openai", operation) as call, get_openai_callback() as cb:
+            rv = llm.invoke(messages).content
+            call.tokens(self.model_id, cb.prompt_tokens, cb.completion_tokens)
+        self.num_tokens_delta += cb.total_tokens
+        self.num_tokens += cb.total_tokens
+        return rv
+
+    def messages(self, prompt: str, context: list[str] | None = None) -> list:
+        system = SYSTEM_PROMPT
+        if self.memory.summary:
+            system += f"\n\nSummary of the earlier conversation:\n{self.memory.summary}"
+        if context:
+            excerpts = "\n\n".join(context)
+            system += f"\n\nExcerpts from the couple's recordings that may be relevant:\n{excerpts}"
+        messages = [SystemMessage(content=system)]
+        for turn in self.memory.turns:
+            message = HumanMessage if turn["role"] == "user" else AIMessage
+            messages.append(message(content=turn["content"]))
+        messages.append(HumanMessage(content=prompt))
+        return messages
+
+    def summarize(self, summary: str, turns: list[dict]) -> str:
+        lines = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+        return self._invoke(
+            "chat_summary",
+            self.summary_llm,
+            [
+                SystemMessage(content=SUMMARY_PROMPT),
+                HumanMessage(content=f"Summary:\n{summary}\n\nNew turns:\n{lines}"),
+            ],
         )
+
+    def response(self, prompt: str, context: list[str] | None = None) -> str:
+        self.num_tokens_delta = 0
+        rv = self._invoke("chat", self.llm, self.messages(prompt, context))
+        self.memory.add("user", prompt)
+        self.memory.add("assistant", rv)
+        self.memory.fold(self.summarize)
+        return rv
@@ -0,0 +1,190 @@
+import io
+import string
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable
+import assemblyai as aai
+from aligner import align_speakers
+from metrics import instrument
+from transcript import format_timestamp
+
+CHUNK_SECS = 300
+OVERLAP_SECS = 10
+MAX_CHUNK_WORKERS = 4
+MAX_CAPTION_WORDS = 10
+
+
+@dataclass
+class Word:
+    text: str
+    start: int
+    end: int
+    speaker: str
+
+
+@dataclass
+class AudioChunk:
+    index: int
+    offset_ms: int
+    duration_ms: int
+    data: bytes
+
+
+def chunk_words(transcript, chunk: AudioChunk) -> list[Word]:
+    # a job the server failed is returned, not raised, and has no utterances
+    if transcript.status == aai.TranscriptStatus.error:
+        raise RuntimeError(
+            f"Transcribing chunk {chunk.index} failed: {transcript.error}"
+        )
+    return [
+        Word(
+            text=w.text,
+            start=w.start + chunk.offset_ms,
+            end=w.end + chunk.offset_ms,
+            speaker=u.speaker,
+        )
+        for u in transcript.utterances or []
+        for w in u.words
+    ]
+
+
+def stitch(
+    previous: list[Word], words: list[Word], overlap_start_ms: int, cut_ms: int
+) -> list[Word]:
+    """Relabels the speakers of a chunk to match the previous chunk, using the
+    words both chunks transcribed in the overlap, and drops the overlap duplicates"""
+    overlap_prev = [w for w in previous if w.end > overlap_start_ms]
+    votes = {}
+    if overlap_prev:
+        matched = align_speakers(
+            [w.start for w in words],
+            [w.end for w in words],
+            [w.start for w in overlap_prev],
+            [w.end for w in overlap_prev],
+            [w.speaker for w in overlap_prev],
+        )
+        for w, prev_speaker in zip(words, matched):
+            if w.start < overlap_prev[-1].end:
+                speaker_votes = votes.setdefault(w.speaker, {})
+                speaker_votes[prev_speaker] = (
+                    speaker_votes.get(prev_speaker, 0) + w.end - w.start
+                )
+    mapping = {s: max(v, key=v.get) for s, v in votes.items()}
+    # speakers silent during the overlap are paired with previous speakers that
+    # were not matched, which is exact for two-person conversations
+    unmatched = [
+        s
+        for s in dict.fromkeys(w.speaker for w in previous)
+        if s not in mapping.values()
+    ]
+    used = {w.speaker for w in previous}
+    for w in words:
+        if w.speaker not in mapping:
+            if unmatched:
+                mapping[w.speaker] = unmatched.pop(0)
+            else:
+                mapping[w.speaker] = next(
+                    l for l in string.ascii_uppercase if l not in used
+                )
+            used.add(mapping[w.speaker])
+    kept = [w for w in previous if w.start < cut_ms]
+    kept.extend(
+        Word(w.text, w.start, w.end, mapping[w.speaker])
+        for w in words
+        if w.start >= cut_ms
+    )
+    return kept
+
+
+def words_to_vtt(words: list[Word]) -> str:
+    cues = []
+    caption = []
+    for w in words:
+        if caption and (
+            w.speaker != caption[0].speaker or len(caption) >= MAX_CAPTION_WORDS
+        ):
+            cues.append(caption)
+            caption = []
+        caption.append(w)
+    if caption:
+        cues.append(caption)
+    return "WEBVTT\n\n" + "\n\n".join(
+        f"{format_timestamp(c[0].start)} --> {format_timestamp(c[-1].end)}\n"
+        f"{c[0].speaker}: {' '.join(w.text for w in c)}"
+        for c in cues
+    )
+
+
+class ChunkedTranscriber:
+    """Transcribes audio chunks concurrently and stitches them back together in order"""
+
+    def __init__(
+        self,
+        transcriber,
+        max_workers: int = MAX_CHUNK_WORKERS,
+        overlap_secs: int = OVERLAP_SECS,
+        to_original: Callable[[int, bool], int] | None = None,
+    ) -> None:
+        self.transcriber = transcriber
+        self.max_workers = max_workers
+        self.overlap_ms = overlap_secs * 1000
+        self.to_original = to_original
+
+    def _remap(self, words: list[Word]) -> list[Word]:
+        if not self.to_original:
+            return words
+        return [
+            Word(
+                w.text,
+                self.to_original(w.start, False),
+                self.to_original(w.end, True),
+                w.speaker,
+            )
+            for w in words
+        ]
+
+    def transcribe(
+        self,
+        chunks: Iterable[AudioChunk],
+        on_partial: Callable[[list[Word], int], None] | None = None,
+    ) -> list[Word]:
+        words = []
+        pending = {}
+        next_index = 0
+
+        def transcribe_chunk(chunk: AudioChunk) -> list[Word]:
+            with instrument("assemblyai", "transcribe"):
+                transcript = self.transcriber.transcribe(io.BytesIO(chunk.data))
+            return chunk_words(transcript, chunk)
+
+        def drain(block: bool) -> None:
+            nonlocal words, next_index
+            while next_index in pending:
+                chunk, future = pending[next_index]
+                if not block and not future.done():
+                    return
+                del pending[next_index]
+                if next_index:
+                    words = stitch(
+                        words,
+                        future.result(),
+                        chunk.offset_ms,
+                        chunk.offset_ms + self.overlap_ms // 2,
+                    )
+                else:
+                    words = future.result()
+                next_index += 1
+                if on_partial:
+                    on_partial(self._remap(words), next_index)
+                block = False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for chunk in chunks:
+                pending[chunk.index] = (
+                    chunk,
+                    executor.submit(transcribe_chunk, chunk),
+                )
+                drain(block=len(pending) > self.max_workers)
+            while pending:
+                drain(block=True)
+        return self._remap(words)
@@ -0,0 +1,64 @@
+import atexit
+import threading
+from typing import Callable, Mapping
+import assemblyai as aai
+import streamlit as st
+from openai import OpenAI
+from supabase import create_client, Client
+from store import DBClient
+from notifier import CoupleNotifier, LocalCoupleNotifier
+
+
+class ClientRegistry:
+    """Process-wide owner of the external service clients and their connection pools"""
+
+    def __init__(self, secrets: Mapping) -> None:
+        self.secrets = secrets
+        self.lock = threading.RLock()
+        self.clients = {}
+
+    def _get(self, name: str, factory: Callable):
+        with self.lock:
+            if name not in self.clients:
+                self.clients[name] = factory()
+            return self.clients[name]
+
+    def openai(self) -> OpenAI:
+        return self._get("openai", OpenAI)
+
+    def supabase(self) -> Client:
+        return self._get("supabase", self.new_supabase)
+
+    def new_supabase(self) -> Client:
+        return create_client(self.secrets["SUPABASE_URL"], self.secrets["SUPABASE_KEY"])
+
+    def db_client(self) -> DBClient:
+        return self._get(
+            "db_client",
+            lambda: DBClient(self.supabase(), auth_client_factory=self.new_supabase),
+        )
+
+    def transcriber(self) -> aai.Transcriber:
+        def create() -> aai.Transcriber:
+            aai.settings.api_key = self.secrets["ASSEMBLYAI_API_KEY"]
+            return aai.Transcriber(config=aai.TranscriptionConfig(speaker_labels=True))
+
+        return self._get("transcriber", create)
+
+    def couple_notifier(self) -> CoupleNotifier:
+        return self._get("couple_notifier", LocalCoupleNotifier)
+
+    def close(self) -> None:
+        with self.lock:
+            for client in self.clients.values():
+                close = getattr(client, "close", None)
+                if callable(close):
+                    close()
+            self.clients.clear()
+
+
+@st.cache_resource
+def get_registry() -> ClientRegistry:
+    registry = ClientRegistry(st.secrets)
+    atexit.register(registry.close)
+    return registry
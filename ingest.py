@@ -0,0 +1,269 @@
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import requests
+from analysis_runner import enqueue_recording_analysis
+from jobs import SQLiteJobQueue
+from s3_index import S3KeyIndex
+from store import DBClient
+from transcript import Transcript
+from utils import REQUEST_TIMEOUT_SECS, ZoomClient, get_s3_object_keys
+
+ZOOM_PREFIX = "zoom/"
+MAX_INGEST_WORKERS = 4
+# S3 rejects multipart parts under 5MB except for the last one
+PART_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+AUDIO_NAME = "audio.m4a"
+TRANSCRIPT_NAME = "transcript.vtt"
+# each meeting's done marker, written by runs before INGESTED_PREFIX existed
+RECORDING_ID_NAME = "recording_id"
+# done markers are named <UTC write time>_<meeting_recording_id>, so that they
+# sort in the order they were written
+INGESTED_PREFIX = f"{ZOOM_PREFIX}_ingested/"
+# recording ids are derived from Zoom's meeting uuid within this namespace
+RECORDING_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "https://zoom.us/recording")
+
+
+@dataclass
+class IngestReport:
+    ingested: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+
+
+def meeting_recording_id(meeting: dict) -> str:
+    return str(uuid.uuid5(RECORDING_NAMESPACE, meeting["uuid"]))
+
+
+def meeting_prefix(meeting: dict) -> str:
+    name = re.sub(r"[^\w.-]+", "_", f"{meeting['topic']}_{meeting['start_time']}")
+    return f"{ZOOM_PREFIX}{name}/"
+
+
+class S3MultipartWriter:
+    """Uploads a byte stream as an S3 multipart upload, picking up an interrupted
+    upload of the same key where its completed parts end"""
+
+    def __init__(self, s3_client, bucket: str, key: str) -> None:
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.upload_id = None
+        self.parts = []
+
+    def resume(self) -> int:
+        """Finds or starts the upload and returns the number of bytes already stored"""
+        uploads = self.s3.list_multipart_uploads(
+            Bucket=self.bucket, Prefix=self.key
+        ).get("Uploads", [])
+        uploads = [u for u in uploads if u["Key"] == self.key]
+        if uploads:
+            self.upload_id = uploads[-1]["UploadId"]
+            paginator = self.s3.get_paginator("list_parts")
+            for page in paginator.paginate(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            ):
+                self.parts.extend(page.get("Parts", []))
+            self.parts.sort(key=lambda p: p["PartNumber"])
+        else:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key
+            )["UploadId"]
+        return sum(p["Size"] for p in self.parts)
+
+    def upload_part(self, data: bytes) -> None:
+        part_number = len(self.parts) + 1
+        etag = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )["ETag"]
+        self.parts.append({"PartNumber": part_number, "ETag": etag, "Size": len(data)})
+
+    def complete(self) -> None:
+        if not self.parts:
+            # S3 cannot complete an upload without parts
+            self.s3.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=b"")
+            return
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": p["PartNumber"], "ETag": p["ETag"]}
+                    for p in self.parts
+                ]
+            },
+        )
+
+
+def stream_to_s3(
+    session: requests.Session, url: str, s3_client, bucket: str, key: str
+) -> None:
+    writer = S3MultipartWriter(s3_client, bucket, key)
+    offset = writer.resume()
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with session.get(
+        url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT_SECS
+    ) as response:
+        # an interrupted upload may already hold every byte
+        chunks = []
+        if response.status_code != 416:
+            response.raise_for_status()
+            chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+        # servers that ignore the range resend the whole file
+        skip = offset if offset and response.status_code != 206 else 0
+        buffer = bytearray()
+        for chunk in chunks:
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk = chunk[dropped:]
+                skip -= dropped
+            buffer.extend(chunk)
+            if len(buffer) >= PART_SIZE:
+                writer.upload_part(bytes(buffer[:PART_SIZE]))
+                del buffer[:PART_SIZE]
+        if buffer:
+            writer.upload_part(bytes(buffer))
+    writer.complete()
+
+
+class ZoomIngester:
+    """Copies a Zoom account's cloud recordings into S3 and creates a recording for
+    each meeting's transcript. Meetings are ingested concurrently; finished ones
+    get a done marker under INGESTED_PREFIX so reruns skip them"""
+
+    def __init__(
+        self,
+        zoom: ZoomClient,
+        s3_client,
+        db_client: DBClient,
+        couple_id: str,
+        bucket: str | None = None,
+        queue: SQLiteJobQueue | None = None,
+        key_index: S3KeyIndex | None = None,
+        max_workers: int = MAX_INGEST_WORKERS,
+    ) -> None:
+        self.zoom = zoom
+        self.s3 = s3_client
+        self.db_client = db_client
+        self.couple_id = couple_id
+        self.bucket = bucket or os.getenv("S3_BUCKET")
+        self.queue = queue
+        self.key_index = key_index
+        self.max_workers = max_workers
+
+    def _list(self, prefix: str) -> list[str]:
+        paginator = self.s3.get_paginator("list_objects_v2")
+        return [
+            c["Key"]
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix)
+            for c in page.get("Contents", [])
+        ]
+
+    def ingested_meetings(self) -> set[str]:
+        """meeting_recording_id of every meeting whose done marker is stored"""
+        if self.key_index:
+            # markers sort by the time they were written, so an incremental sync
+            # only has to list the ones written since the last
+            self.key_index.sync(INGESTED_PREFIX)
+            keys = self.key_index.keys(INGESTED_PREFIX)
+        else:
+            keys = get_s3_object_keys(self.s3, INGESTED_PREFIX)
+        return {key.rpartition("_")[2] for key in keys}
+
+    def _mark_ingested(self, meeting: dict, recording_id: str) -> None:
+        ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        key = f"{INGESTED_PREFIX}{ts}_{meeting_recording_id(meeting)}"
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=recording_id.encode())
+        if self.key_index:
+            self.key_index.add(key)
+
+    def ingest(self, num_lookback_months: int) -> IngestReport:
+        report = IngestReport()
+        ingested = self.ingested_meetings()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            for meeting in self.zoom.iter_recordings(num_lookback_months):
+                if meeting_recording_id(meeting) in ingested:
+                    report.skipped.append(meeting["uuid"])
+                    continue
+                future = executor.submit(self.ingest_meeting, meeting)
+                futures[future] = meeting["uuid"]
+            for future in as_completed(futures):
+                try:
+                    recording_id = future.result()
+                except Exception as e:
+                    report.failed[futures[future]] = repr(e)
+                else:
+                    if recording_id is None:
+                        report.skipped.append(futures[future])
+                    else:
+                        report.ingested.append(futures[future])
+        return report
+
+    def ingest_meeting(self, meeting: dict) -> str | None:
+        """Ingests a meeting and returns its recording id, or None when it had
+        been ingested before done markers were written"""
+        prefix = meeting_prefix(meeting)
+        existing = set(self._list(prefix))
+        legacy_marker = prefix + RECORDING_ID_NAME
+        if legacy_marker in existing:
+            recording_id = (
+                self.s3.get_object(Bucket=self.bucket, Key=legacy_marker)["Body"]
+                .read()
+                .decode()
+            )
+            self._mark_ingested(meeting, recording_id)
+            return None
+
+        transcript_key = prefix + TRANSCRIPT_NAME
+        if transcript_key not in existing:
+            stream_to_s3(
+                self.zoom.session,
+                self.zoom.get_transcript_download_url(meeting["id"]),
+                self.s3,
+                self.bucket,
+                transcript_key,
+            )
+        audio_key = prefix + AUDIO_NAME
+        if audio_key not in existing:
+            try:
+                audio_url = self.zoom.get_audio_download_url(meeting["id"])
+            except IndexError:
+                # meetings recorded without an audio-only file
+                audio_url = None
+            if audio_url:
+                stream_to_s3(
+                    self.zoom.session, audio_url, self.s3, self.bucket, audio_key
+                )
+
+        vtt = (
+            self.s3.get_object(Bucket=self.bucket, Key=transcript_key)["Body"]
+            .read()
+            .decode()
+        )
+        # the id is fixed by the meeting, so a run that crashed before writing the
+        # done marker rewrites its recording rather than adding a duplicate
+        recording_id = self.db_client.upsert_recording(
+            meeting_recording_id(meeting),
+            couple_id=self.couple_id,
+            transcript=vtt,
+            transcript_compact=Transcript.from_vtt(vtt).encode(),
+            # backfilled meetings keep their own date on the dashboard
+            created_at=meeting["start_time"],
+        )
+        self._mark_ingested(meeting, recording_id)
+        if self.queue:
+            enqueue_recording_analysis(self.queue, recording_id)
+        return recording_id
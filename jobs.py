@@ -0,0 +1,205 @@
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    recording_id: str
+    interval: int
+    attempts: int
+
+
+class SQLiteJobQueue:
+    """Durable analysis job queue, deduplicated on (kind, recording_id, interval)"""
+
+    def __init__(self, path: str) -> None:
+        self.db = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, recording_id TEXT NOT NULL, interval INTEGER NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, run_at REAL NOT NULL, updated_at REAL NOT NULL, UNIQUE (kind, recording_id, interval))"
+            )
+
+    def enqueue(
+        self, kind: str, recording_id: str, interval: int, force: bool = False
+    ) -> None:
+        """Adds a job unless an equivalent one exists; failed jobs are always
+        re-queued, and force also re-queues done or running ones"""
+        now = time.time()
+        requeue = (JOB_FAILED, JOB_DONE, JOB_RUNNING) if force else (JOB_FAILED,)
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO jobs (kind, recording_id, interval, status, run_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (kind, recording_id, interval) DO UPDATE SET status = excluded.status, attempts = 0, error = NULL, run_at = excluded.run_at, updated_at = excluded.updated_at "
+                f"WHERE jobs.status IN ({','.join('?' * len(requeue))})",
+                (kind, recording_id, interval, JOB_PENDING, now, now, *requeue),
+            )
+
+    def claim(self) -> Job | None:
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT id, kind, recording_id, interval, attempts FROM jobs WHERE status = ? AND run_at <= ? ORDER BY run_at LIMIT 1",
+                    (JOB_PENDING, now),
+                ).fetchone()
+                if row:
+                    self.db.execute(
+                        "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+                        (JOB_RUNNING, now, row[0]),
+                    )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return Job(*row) if row else None
+
+    def claim_job(self, kind: str, recording_id: str, interval: int) -> Job | None:
+        """Claims one pending job for work outside the workers, so that no worker
+        runs it meanwhile; None when it is not pending"""
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT id, kind, recording_id, interval, attempts FROM jobs WHERE kind = ? AND recording_id = ? AND interval = ? AND status = ?",
+                    (kind, recording_id, interval, JOB_PENDING),
+                ).fetchone()
+                if row:
+                    self.db.execute(
+                        "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+                        (JOB_RUNNING, now, row[0]),
+                    )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return Job(*row) if row else None
+
+    def release(self, job: Job) -> None:
+        """Hands a claimed job back to the workers"""
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (JOB_PENDING, time.time(), job.id, JOB_RUNNING),
+            )
+
+    def complete(self, job: Job) -> None:
+        # a job re-queued while it was running stays pending
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, error = NULL, updated_at = ? WHERE id = ? AND status = ?",
+                (JOB_DONE, time.time(), job.id, JOB_RUNNING),
+            )
+
+    def retry(
+        self, job: Job, error: str, max_attempts: int, backoff_secs: float
+    ) -> None:
+        attempts = job.attempts + 1
+        status = JOB_PENDING if attempts < max_attempts else JOB_FAILED
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, attempts = ?, error = ?, run_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (
+                    status,
+                    attempts,
+                    error,
+                    now + backoff_secs * 2 ** (attempts - 1),
+                    now,
+                    job.id,
+                    JOB_RUNNING,
+                ),
+            )
+
+    def requeue_running(self) -> None:
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = ? WHERE status = ?",
+                (JOB_PENDING, JOB_RUNNING),
+            )
+
+    def num_open(self) -> int:
+        """Jobs still pending or running"""
+        with self.lock:
+            return self.db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)",
+                (JOB_PENDING, JOB_RUNNING),
+            ).fetchone()[0]
+
+    def statuses(
+        self, kind: str, recording_ids: list[str], interval: int
+    ) -> dict[str, str]:
+        rv = {}
+        with self.lock:
+            for i in range(0, len(recording_ids), 500):
+                batch = recording_ids[i : i + 500]
+                rows = self.db.execute(
+                    f"SELECT recording_id, status FROM jobs WHERE kind = ? AND interval = ? AND recording_id IN ({','.join('?' * len(batch))})",
+                    (kind, interval, *batch),
+                ).fetchall()
+                rv.update(dict(rows))
+        return rv
+
+
+class WorkerPool:
+    """Threads that claim jobs from the queue and run them outside the request path"""
+
+    def __init__(
+        self,
+        queue: SQLiteJobQueue,
+        handler: Callable[[Job], None],
+        num_workers: int = 4,
+        poll_secs: float = 1.0,
+        max_attempts: int = 3,
+        backoff_secs: float = 30.0,
+    ) -> None:
+        self.queue = queue
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_secs = poll_secs
+        self.max_attempts = max_attempts
+        self.backoff_secs = backoff_secs
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self) -> None:
+        self.queue.requeue_running()
+        for i in range(self.num_workers):
+            thread = threading.Thread(
+                target=self._run, name=f"analysis-worker-{i}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _run(self) -> None:
+        while not self.stop_event.is_set():
+            job = self.queue.claim()
+            if not job:
+                self.stop_event.wait(self.poll_secs)
+                continue
+            try:
+                self.handler(job)
+            except Exception as e:
+                self.queue.retry(job, repr(e), self.max_attempts, self.backoff_secs)
+            else:
+                self.queue.complete(job)
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator, get_args
+from openai import OpenAI
+from pydantic import BaseModel
+from metrics import cache_lookup, instrument
+from streaming_json import ArrayItemParser
+
+DEFAULT_CACHE_PATH = ".llm_cache.sqlite3"
+DEFAULT_MAX_MEMORY_ENTRIES = 256
+DEFAULT_MAX_DISK_BYTES = 256 * 1024 * 1024
+
+
+class LLMCache:
+    """Two-tier (in-memory LRU + SQLite) cache for structured-output completions"""
+
+    def __init__(
+        self,
+        path: str | None = DEFAULT_CACHE_PATH,
+        max_memory_entries: int = DEFAULT_MAX_MEMORY_ENTRIES,
+        max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES,
+    ) -> None:
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = None
+        self.disk_bytes = 0
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.db.commit()
+            self.disk_bytes = self.db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()[0]
+
+    @staticmethod
+    def key(
+        model: str,
+        messages: list[dict],
+        response_format: type[BaseModel],
+        temperature: float | None,
+    ) -> str:
+        payload = json.dumps(
+            {
+                "model": model,
+                "messages": messages,
+                "schema": response_format.model_json_schema(),
+                "temperature": temperature,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return self.memory[key]
+            if self.db:
+                row = self.db.execute(
+                    "SELECT value FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    self.db.execute(
+                        "UPDATE llm_cache SET accessed_at = ? WHERE key = ?",
+                        (time.time(), key),
+                    )
+                    self.db.commit()
+                    self._put_memory(key, row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str) -> None:
+        with self.lock:
+            self._put_memory(key, value)
+            if not self.db:
+                return
+            size = len(value.encode())
+            old = self.db.execute(
+                "SELECT size FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self.disk_bytes += size - (old[0] if old else 0)
+            while self.disk_bytes > self.max_disk_bytes:
+                row = self.db.execute(
+                    "SELECT key, size FROM llm_cache ORDER BY accessed_at LIMIT 1"
+                ).fetchone()
+                if not row:
+                    break
+                self.db.execute("DELETE FROM llm_cache WHERE key = ?", (row[0],))
+                self.memory.pop(row[0], None)
+                self.disk_bytes -= row[1]
+                self.evictions += 1
+            self.db.commit()
+
+    def _put_memory(self, key: str, value: str) -> None:
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_entries": len(self.memory),
+                "disk_bytes": self.disk_bytes,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache() -> LLMCache:
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache(os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH))
+        return _default_cache
+
+
+def cached_parse(
+    client: OpenAI,
+    model: str,
+    messages: list[dict],
+    response_format: type[BaseModel],
+    temperature: float | None = None,
+    cache: LLMCache | None = None,
+    operation: str = "parse",
+    recording_id: str | None = None,
+) -> BaseModel:
+    cache = cache or default_cache()
+    key = LLMCache.key(model, messages, response_format, temperature)
+    cached = cache.get(key)
+    cache_lookup(operation, cached is not None, recording_id)
+    if cached is not None:
+        return response_format.model_validate_json(cached)
+    kwargs = {"temperature": temperature} if temperature is not None else {}
+    with instrument("openai", operation, recording_id) as call:
+        response = client.beta.chat.completions.parse(
+            model=model,
+            messages=messages,
+            response_format=response_format,
+            **kwargs,
+        )
+        call.usage(model, response.usage)
+    parsed = response.choices[0].message.parsed
+    if parsed is not None:
+        cache.put(key, parsed.model_dump_json())
+    return parsed
+
+
+class ParseStream:
+    """Streams a structured-output completion, yielding the items of the list
+    field of response_format as each one completes. After iteration, result holds
+    the whole response, validated and cached like cached_parse and then handed to
+    postprocess"""
+
+    def __init__(
+        self,
+        client: OpenAI,
+        model: str,
+        messages: list[dict],
+        response_format: type[BaseModel],
+        field: str,
+        temperature: float | None = None,
+        cache: LLMCache | None = None,
+        operation: str = "parse",
+        recording_id: str | None = None,
+        postprocess: Callable[[BaseModel], None] | None = None,
+    ) -> None:
+        self.client = client
+        self.model = model
+        self.messages = messages
+        self.response_format = response_format
+        self.field = field
+        self.temperature = temperature
+        self.cache = cache or default_cache()
+        self.operation = operation
+        self.recording_id = recording_id
+        self.postprocess = postprocess
+        self.item_type = get_args(response_format.model_fields[field].annotation)[0]
+        self.result = None
+
+    def __iter__(self) -> Iterator[BaseModel]:
+        key = LLMCache.key(
+            self.model, self.messages, self.response_format, self.temperature
+        )
+        cached = self.cache.get(key)
+        cache_lookup(self.operation, cached is not None, self.recording_id)
+        if cached is not None:
+            self.result = self.response_format.model_validate_json(cached)
+            yield from getattr(self.result, self.field)
+            self._postprocess()
+            return
+
+        kwargs = (
+            {"temperature": self.temperature} if self.temperature is not None else {}
+        )
+        parser = ArrayItemParser(self.field)
+        with instrument("openai", self.operation, self.recording_id) as call:
+            with self.client.beta.chat.completions.stream(
+                model=self.model,
+                messages=self.messages,
+                response_format=self.response_format,
+                stream_options={"include_usage": True},
+                **kwargs,
+            ) as stream:
+                for event in stream:
+                    if event.type == "content.delta":
+                        for item in parser.feed(event.delta):
+                            yield self.item_type.model_validate(item)
+                completion = stream.get_final_completion()
+            call.usage(self.model, completion.usage)
+        self.result = completion.choices[0].message.parsed
+        if self.result is not None:
+            self.cache.put(key, self.result.model_dump_json())
+        self._postprocess()
+
+    def _postprocess(self) -> None:
+        if self.result is not None and self.postprocess:
+            self.postprocess(self.result)
@@ -1,31 +1,59 @@
 import streamlit as st
 from streamlit_url_fragment import get_fragment
-from store import DBClient
+from clients import get_registry
+from notifier import BackoffPoller
+from aligner import align_speakers, speaker_spans
+from transcript import Transcript, timestamp_ms
+from chunked_transcription import ChunkedTranscriber, words_to_vtt
+from audio_preprocessing import iter_encoded_chunks, preprocess
 import jwt
 from gotrue.errors import AuthApiError
 from audiorecorder import audiorecorder
-import assemblyai as aai
 import webvtt
 from streamlit_option_menu import option_menu
 import altair as alt
-from recording_processor import RecordingProcessor
-from chatbot import OpenAIChatbot, ModeAnalysis
-from collections import defaultdict
 import pandas as pd
-
-aai.settings.api_key = st.secrets["ASSEMBLYAI_API_KEY"]
+from catalog import RecordingCatalog
+from analysis_runner import (
+    EMOTION_INTERVAL,
+    JOB_COMBINED,
+    JOB_EMOTION,
+    JOB_MODE,
+    MODE_INTERVAL,
+    ANALYSIS_MODEL_ID,
+    analysis_job_kind,
+    enqueue_recording_analysis,
+    get_job_queue,
+    persist_combined_analysis,
+    get_worker_pool,
+)
+from jobs import JOB_FAILED, JOB_RUNNING
+from chatbot import CombinedAnalysis, OpenAIChatbot
+from recording_processor import RecordingProcessor
+from chat_memory import ChatMemory
+from retrieval import TranscriptRetriever
+from aggregation import (
+    SECONDARY_ORDER,
+    SECONDARY_TO_PRIMARY,
+    emotion_chart_data,
+    mode_chart_data,
+)
+from llm_cache import default_cache
+import metrics
+
+EMOTION_ROLLUP_INTERVALS = [1, 5, 10, 15, 30]
+CHAT_MODEL_ID = "gpt-4o-mini"
+CHAT_TEMPERATURE = 0.7
 
 
 # Initialize connection.
 def init_connection() -> None:
+    registry = get_registry()
     if "db_client" not in st.session_state:
-        st.session_state["db_client"] = DBClient(
-            st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"]
-        )
+        st.session_state["db_client"] = registry.db_client()
     if "transcriber" not in st.session_state:
-        st.session_state["transcriber"] = aai.Transcriber(
-            config=aai.TranscriptionConfig(speaker_labels=True)
-        )
+        st.session_state["transcriber"] = registry.transcriber()
+    get_worker_pool()
 
 
 def login_submit(is_login: bool, invite_partner: bool = False):
@@ -60,6 +88,7 @@ def login_submit(is_login: bool, invite_partner: bool = False):
             st.session_state.db_client.insert_couple(
                 user_id=st.session_state.user.id, partner_id=user.id
             )
+            get_registry().couple_notifier().publish(st.session_state.user.id, user.id)
     except AuthApiError as e:
         st.error(e)
 
@@ -82,6 +111,11 @@ def reset_password_submit(user_id: str):
             user_id, st.session_state.reset_password_password
         )
         st.session_state["authenticated"] = True
+        couple = st.session_state.db_client.get_couple(user_id)
+        if couple:
+            get_registry().couple_notifier().publish(
+                couple["user_id"], couple["partner_id"]
+            )
     except AuthApiError as e:
         st.error(e)
 
@@ -116,7 +150,28 @@ def register_login():
 def check_partner_status():
     if st.session_state.get("couple_id"):
         return
-    record = st.session_state.db_client.get_couple(st.session_state.user.id)
+    user_id = st.session_state.user.id
+    notifier = get_registry().couple_notifier()
+    if "partner_status_poller" not in st.session_state:
+        st.session_state["partner_status_poller"] = BackoffPoller()
+    poller = st.session_state.partner_status_poller
+    version = notifier.version(user_id)
+    if version != st.session_state.get("couple_version"):
+        st.session_state["couple_version"] = version
+        poller.reset()
+    if poller.due():
+        poller.backoff()
+        record = st.session_state.db_client.get_couple(user_id)
+        st.session_state["couple_record"] = record
+        if record:
+            partner_id = record["partner_id"]
+            if user_id == partner_id:
+                partner_id = record["user_id"]
+            st.session_state["partner"] = st.session_state.db_client.get_user(
+                partner_id
+            )
+
+    record = st.session_state.get("couple_record")
     if not record:
         st.info(
             "You haven't invited your partner yet. Please invite your partner by submitting their information."
@@ -126,84 +181,220 @@ def check_partner_status():
             st.text_input("First name", key="register_first_name")
             st.text_input("Last name", key="register_last_name")
             st.form_submit_button("Submit", on_click=login_submit, args=(False, True))
+    elif not st.session_state.partner.confirmed_at:
+        st.error("Your partner has not yet accepted the invitation to sign up.")
     else:
-        partner_id = record["partner_id"]
-        if st.session_state.user.id == partner_id:
-            partner_id = record["user_id"]
-        partner = DBClient(
-            st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"]
-        ).get_user(partner_id)
-        st.session_state["partner"] = partner
-        if not partner.confirmed_at:
-            st.error("Your partner has not yet accepted the invitation to sign up.")
-        else:
-            st.session_state["couple_id"] = record["id"]
-            st.rerun()
+        st.session_state["couple_id"] = record["id"]
+        st.rerun()
 
 
 def process_vtt(transcript_vtt: str, utterances: list) -> str:
-    cur_utterance_idx = 0
     captions = webvtt.from_string(transcript_vtt)
-    for caption in captions:
-        if caption.text in utterances[cur_utterance_idx].text:
-            caption.text = utterances[cur_utterance_idx].speaker + ": " + caption.text
-        else:
-            cur_utterance_idx += 1
+    speakers = align_speakers(
+        [timestamp_ms(c.start) for c in captions],
+        [timestamp_ms(c.end) for c in captions],
+        *speaker_spans(utterances),
+    )
+    for caption, speaker in zip(captions, speakers):
+        if speaker:
+            caption.text = speaker + ": " + caption.text
     return captions.content
 
 
 def create_recording():
     audio = st.audio_input("Record a conversation")
-    if audio:
+    if not audio or st.session_state.get("recorded_audio_id") == audio.file_id:
+        return
+    if st.session_state.get("failed_audio_id") == audio.file_id:
+        st.error("Transcribing this recording failed")
+        if not st.button("Retry transcription"):
+            return
+    db_client = st.session_state.db_client
+    status = st.empty()
+    recording_id = None
+
+    def store_partial(words: list, num_chunks: int) -> None:
+        nonlocal recording_id
+        vtt = words_to_vtt(words)
+        transcript_compact = Transcript.from_vtt(vtt).encode()
+        if recording_id is None:
+            recording_id = db_client.insert_recording(
+                couple_id=st.session_state.couple_id,
+                transcript=vtt,
+                transcript_compact=transcript_compact,
+            )
+        else:
+            db_client.update_recording_transcript(recording_id, vtt, transcript_compact)
+        status.info(f"Transcribed {num_chunks} chunks")
+
+    try:
+        with st.spinner("Preprocessing audio"):
+            preprocessed = preprocess(audio.getvalue())
         with st.spinner("Transcribing audio"):
-            transcript = st.session_state.transcriber.transcribe(audio)
-        vtt = process_vtt(transcript.export_subtitles_vtt(), transcript.utterances)
-        st.session_state.db_client.insert_recording(
-            couple_id=st.session_state.couple_id,
-            transcript=vtt,
+            ChunkedTranscriber(
+                st.session_state.transcriber,
+                to_original=preprocessed.time_map.to_original,
+            ).transcribe(iter_encoded_chunks(preprocessed), on_partial=store_partial)
+    except Exception as e:
+        # a partial transcript must not be analyzed or duplicated by a retry
+        if recording_id is not None:
+            db_client.delete_recording(recording_id)
+        st.session_state["failed_audio_id"] = audio.file_id
+        status.error(f"Transcribing this recording failed: {e}")
+        return
+    st.session_state["recorded_audio_id"] = audio.file_id
+    if st.session_state.get("catalog"):
+        st.session_state.catalog.invalidate()
+    if recording_id is None:
+        status.warning("No speech was transcribed")
+        return
+    status.success(
+        f"Recording saved. Uploaded {preprocessed.encoded_bytes / 1e6:.1f} MB "
+        f"instead of {preprocessed.original_bytes / 1e6:.1f} MB "
+        f"({preprocessed.duration_ms // 1000}s of {preprocessed.original_ms // 1000}s kept)"
+    )
+    enqueue_recording_analysis(get_job_queue(), recording_id, force=True)
+
+
+def report_pending_analysis(
+    name: str, kind: str, interval: int, missing_ids: list[str]
+) -> None:
+    if not missing_ids:
+        return
+    queue = get_job_queue()
+    kind = analysis_job_kind(kind)
+    statuses = queue.statuses(kind, missing_ids, interval)
+    for recording_id in missing_ids:
+        if statuses.get(recording_id) != JOB_FAILED:
+            queue.enqueue(kind, recording_id, interval)
+    num_failed = sum(s == JOB_FAILED for s in statuses.values())
+    if len(missing_ids) > num_failed:
+        st.info(f"{name} pending for {len(missing_ids) - num_failed} recordings")
+    if num_failed:
+        st.warning(f"{name} failed for {num_failed} recordings")
+    # recordings a worker is already analyzing are left to it
+    analyze_now(
+        kind,
+        interval,
+        [r for r in missing_ids if statuses.get(r) != JOB_RUNNING],
+    )
+
+
+def analyze_now(kind: str, interval: int, recording_ids: list[str]) -> None:
+    """Analyzes one pending recording in the foreground, charting intervals as
+    they stream in, and stores the result of the given job kind"""
+    if not recording_ids:
+        return
+    rps = {rp.id: rp for rp in st.session_state.rps}
+    recording_id = st.selectbox(
+        "Pending recording",
+        recording_ids,
+        format_func=lambda r: str(rps[r].ts),
+        key=f"analyze_now_{kind}",
+    )
+    if not st.button("Analyze now", key=f"analyze_now_button_{kind}"):
+        return
+    queue = get_job_queue()
+    job = queue.claim_job(kind, recording_id, interval)
+    if job is None:
+        st.info("This recording is already being analyzed in the background")
+        return
+    try:
+        result = stream_analysis(rps[recording_id], interval)
+    except Exception:
+        queue.release(job)
+        raise
+    if result is None:
+        queue.release(job)
+        return
+    db_client = st.session_state.db_client
+    if kind == JOB_COMBINED:
+        persist_combined_analysis(db_client, recording_id, interval, result)
+    elif kind == JOB_MODE:
+        db_client.insert_mode_analysis(
+            recording_id, result.mode_analysis().model_dump()
         )
+    else:
+        db_client.insert_emotion_analysis(
+            recording_id, interval, result.emotion_analysis().model_dump()
+        )
+    queue.complete(job)
+    st.rerun()
+
+
+def stream_analysis(rp: RecordingProcessor, interval: int) -> CombinedAnalysis | None:
+    status = st.empty()
+    modes_chart = st.empty()
+    emotions_chart = st.empty()
+    modes, emotions = [], []
+    stream = rp.stream_combined_analysis(interval)
+    for i, item in enumerate(stream):
+        try:
+            minute = timestamp_ms(item.start_time) // 60000
+        except ValueError:
+            continue
+        modes.append({"minute": minute, "mode": item.mode.value})
+        emotions.extend(
+            {"minute": minute, "primary": SECONDARY_TO_PRIMARY[e.value]}
+            for e in item.emotions
+        )
+        status.info(f"Analyzed {i + 1} intervals")
+        modes_chart.altair_chart(
+            alt.Chart(pd.DataFrame(modes))
+            .mark_rect()
+            .encode(
+                x=alt.X("minute:O").title("Minute"),
+                color=alt.Color("mode", scale=alt.Scale(scheme="dark2")),
+            ),
+            use_container_width=True,
+        )
+        if emotions:
+            emotions_chart.altair_chart(
+                alt.Chart(pd.DataFrame(emotions))
+                .mark_bar()
+                .encode(
+                    x=alt.X("minute:O").title("Minute"),
+                    y=alt.Y("count():Q").stack("normalize").title(None),
+                    color=alt.Color("primary", scale=alt.Scale(scheme="dark2")),
+                ),
+                use_container_width=True,
+            )
+
+    if stream.result is None:
+        status.error("The analysis could not be completed")
+    return stream.result
 
 
 def mode_analysis():
-    num_intervals = 0
-    mode_counts = defaultdict(lambda: defaultdict(int))
-    mode_analysis_by_ts = {}
-    for rp in st.session_state.rps:
-        print(rp.id)
-        mode_analysis_json = st.session_state.db_client.get_mode_analysis(rp.id)
-        if mode_analysis_json:
-            mode_analysis = ModeAnalysis(**mode_analysis_json)
-        else:
-            mode_analysis = rp.get_mode_analysis(1)
-            mode_analysis_json = mode_analysis.model_dump()
-            st.session_state.db_client.insert_mode_analysis(rp.id, mode_analysis_json)
-        num_intervals += len(mode_analysis.modes)
-        for m in mode_analysis.modes:
-            mode_counts[rp.ts][m.label.value] += 1
-        mode_analysis_by_ts[rp.ts] = mode_analysis_json
-
-        # modes.sort(key=lambda m: m[1].label)
-        # to_label = [random.choice(list(v)) for _, v in groupby(modes, lambda m: m[1].label)]
-
-    mode_data = [
-        {
-            "timestamp": ts,
-            "mode": m,
-            "count": c,
-            "num_intervals": len(mode_analysis_by_ts[ts]["modes"]),
-            "tot_num_intervals": num_intervals,
-        }
-        for ts, mc in mode_counts.items()
-        for m, c in mc.items()
-    ]
-    mode_data_df = pd.DataFrame(mode_data)
+    # the aggregate covers the couple's whole history, not just this page, so
+    # every analysis is fetched once and the page's are taken from them
+    timestamps = st.session_state.catalog.all_timestamps()
+    page_ids = [rp.id for rp in st.session_state.rps]
+    all_jsons = {
+        k: v
+        for k, v in st.session_state.db_client.get_mode_analyses(
+            list(timestamps)
+        ).items()
+        if v
+    }
+    report_pending_analysis(
+        "Mode analysis",
+        JOB_MODE,
+        MODE_INTERVAL,
+        [r for r in page_ids if r not in all_jsons],
+    )
+
+    mode_analysis_jsons = {r: all_jsons[r] for r in page_ids if r in all_jsons}
+    if not mode_analysis_jsons:
+        st.info("No mode analysis available yet")
+        return
+
+    per_recording, _ = mode_chart_data(
+        mode_analysis_jsons, {rp.id: rp.ts for rp in st.session_state.rps}
+    )
+    _, overall = mode_chart_data(all_jsons, timestamps)
     chart = (
-        alt.Chart(
-            mode_data_df.groupby(["mode", "tot_num_intervals"])
-            .sum("count")
-            .reset_index()
-        )
-        .transform_calculate(percent="datum.count*100/datum.tot_num_intervals")
+        alt.Chart(overall)
         .mark_bar()
         .encode(
             x=alt.X(
@@ -218,7 +409,7 @@ def mode_analysis():
     st.altair_chart(chart, use_container_width=True)
 
     chart = (
-        alt.Chart(mode_data_df)
+        alt.Chart(per_recording)
         .mark_bar()
         .encode(
             x=alt.X("count:Q").stack("normalize").title(None),
@@ -232,33 +423,176 @@ def mode_analysis():
     st.altair_chart(chart, use_container_width=True)
 
 
+def emotion_analysis():
+    emotion_analysis_jsons = st.session_state.db_client.get_emotion_analyses(
+        [rp.id for rp in st.session_state.rps], EMOTION_INTERVAL
+    )
+    report_pending_analysis(
+        "Emotion analysis",
+        JOB_EMOTION,
+        EMOTION_INTERVAL,
+        [rp.id for rp in st.session_state.rps if not emotion_analysis_jsons.get(rp.id)],
+    )
+    emotion_analysis_jsons = {k: v for k, v in emotion_analysis_jsons.items() if v}
+    if not emotion_analysis_jsons:
+        st.info("No emotion analysis available yet")
+        return
+
+    timestamps = {rp.id: rp.ts for rp in st.session_state.rps}
+    recording_id = st.selectbox(
+        "Recording",
+        sorted(emotion_analysis_jsons, key=lambda r: timestamps[r], reverse=True),
+        format_func=lambda r: str(timestamps[r]),
+    )
+    interval = st.select_slider(
+        "Interval (minutes)", options=EMOTION_ROLLUP_INTERVALS, value=5
+    )
+    primary, secondary = emotion_chart_data(
+        emotion_analysis_jsons, timestamps, interval
+    )
+    primary = primary[primary["recording_id"] == recording_id]
+    secondary = secondary[secondary["recording_id"] == recording_id]
+
+    chart = (
+        alt.Chart(primary)
+        .mark_bar()
+        .encode(
+            x=alt.X("start_minute:O").title("Minute"),
+            y=alt.Y("count:Q").stack("normalize").title(None),
+            color=alt.Color("primary", scale=alt.Scale(scheme="dark2")),
+        )
+    )
+    st.subheader("Primary Emotions", divider=True)
+    st.altair_chart(chart, use_container_width=True)
+
+    chart = (
+        alt.Chart(
+            secondary.groupby(["primary", "secondary"])["count"].sum().reset_index()
+        )
+        .mark_bar()
+        .encode(
+            x=alt.X("secondary:O", sort=SECONDARY_ORDER),
+            y="count:Q",
+            color=alt.Color("primary", scale=alt.Scale(scheme="dark2")),
+        )
+    )
+    st.subheader("Secondary Emotions", divider=True)
+    st.altair_chart(chart, use_container_width=True)
+
+
+def get_catalog() -> RecordingCatalog:
+    catalog = st.session_state.get("catalog")
+    if not catalog or catalog.couple_id != st.session_state.couple_id:
+        catalog = RecordingCatalog(
+            st.session_state.db_client,
+            st.session_state.couple_id,
+            OpenAIChatbot(model_id=ANALYSIS_MODEL_ID, temperature=0.0),
+        )
+        st.session_state["catalog"] = catalog
+    else:
+        catalog.refresh()
+    return catalog
+
+
 def dashboard():
     with st.sidebar:
         dashboard_option = option_menu(
             "",
             [
                 "Mode Analysis",
+                "Emotion Analysis",
             ],
             icons=[
                 "emoji-heart-eyes",
+                "emoji-smile",
             ],
         )
 
-    recordings = st.session_state.db_client.get_recordings(st.session_state.couple_id)
-    st.session_state["rps"] = [
-        RecordingProcessor(
-            id=rec["id"],
-            ts=rec["created_at"],
-            transcript=rec["transcript"],
-            chatbot=OpenAIChatbot(model_id="gpt-4o-2024-08-06", temperature=0.0),
-            db_client=st.session_state.db_client,
-        )
-        for rec in recordings
-    ]
+    catalog = get_catalog()
+    with st.sidebar:
+        page = 1
+        if catalog.num_pages() > 1:
+            page = st.number_input(
+                "Recordings page", min_value=1, max_value=catalog.num_pages()
+            )
+    st.session_state["rps"] = catalog.page(page - 1)
 
     match dashboard_option:
         case "Mode Analysis":
             mode_analysis()
+        case "Emotion Analysis":
+            emotion_analysis()
+
+
+def get_chatbot() -> OpenAIChatbot:
+    couple_id = st.session_state.couple_id
+    if st.session_state.get("chat_couple_id") != couple_id:
+        memory = ChatMemory.from_dict(
+            CHAT_MODEL_ID, st.session_state.db_client.get_chat_memory(couple_id)
+        )
+        st.session_state["chatbot"] = OpenAIChatbot(
+            model_id=CHAT_MODEL_ID, temperature=CHAT_TEMPERATURE, memory=memory
+        )
+        st.session_state["chat_couple_id"] = couple_id
+    # grounded in the latest page of recordings, rebuilt whenever it changes
+    rps = get_catalog().page(0)
+    ids = [rp.id for rp in rps]
+    if st.session_state.get("retriever_ids") != ids:
+        st.session_state["retriever"] = TranscriptRetriever(rps)
+        st.session_state["retriever_ids"] = ids
+    return st.session_state.chatbot
+
+
+def chat_page():
+    chatbot = get_chatbot()
+    if chatbot.memory.summary:
+        with st.expander("Earlier in this conversation"):
+            st.write(chatbot.memory.summary)
+    for turn in chatbot.memory.turns:
+        with st.chat_message(turn["role"]):
+            st.write(turn["content"])
+
+    prompt = st.chat_input("Ask about your conversations")
+    if not prompt:
+        return
+    with st.chat_message("user"):
+        st.write(prompt)
+    with st.chat_message("assistant"):
+        with st.spinner("Thinking..."):
+            passages = st.session_state.retriever.search(prompt, CHAT_MODEL_ID)
+            answer = chatbot.response(prompt, [p.render() for p in passages])
+        st.write(answer)
+        st.caption(f"{chatbot.num_tokens_delta} tokens")
+    st.session_state.db_client.upsert_chat_memory(
+        st.session_state.couple_id, chatbot.memory.to_dict()
+    )
+
+
+def is_admin() -> bool:
+    return st.session_state.user.email in st.secrets.get("ADMIN_EMAILS", [])
+
+
+def metrics_page():
+    st.subheader("External calls", divider=True)
+    st.dataframe(metrics.operation_stats(), use_container_width=True)
+
+    st.subheader("LLM tokens", divider=True)
+    st.dataframe(metrics.token_stats(), use_container_width=True)
+
+    st.subheader("Model cascade", divider=True)
+    st.dataframe(metrics.cascade_stats(), use_container_width=True)
+
+    st.subheader("LLM cache", divider=True)
+    st.json(default_cache().stats())
+
+    st.subheader("Per recording", divider=True)
+    st.dataframe(
+        [{"recording_id": k, **v} for k, v in metrics.recording_stats().items()],
+        use_container_width=True,
+    )
+
+    with st.expander("Prometheus exposition"):
+        st.code(metrics.render_prometheus(), language="text")
 
 
 def main():
@@ -277,21 +611,25 @@ def main():
             st.info(
                 f"Your partner is {st.session_state.partner.user_metadata["first_name"]} {st.session_state.partner.user_metadata["last_name"]}"
             )
-            pg = st.navigation(
-                [
-                    st.Page(
-                        create_recording,
-                        title="Create Recording",
-                        icon=":material/mic:",
-                        default=True,
-                    ),
-                    st.Page(
-                        dashboard,
-                        title="Dashboard",
-                        icon=":material/dashboard:",
-                    ),
-                ]
-            )
+            pages = [
+                st.Page(
+                    create_recording,
+                    title="Create Recording",
+                    icon=":material/mic:",
+                    default=True,
+                ),
+                st.Page(
+                    dashboard,
+                    title="Dashboard",
+                    icon=":material/dashboard:",
+                ),
+                st.Page(chat_page, title="Chat", icon=":material/chat:"),
+            ]
+            if is_admin():
+                pages.append(
+                    st.Page(metrics_page, title="Metrics", icon=":material/monitoring:")
+                )
+            pg = st.navigation(pages)
             pg.run()
 
     elif "reset_password" in st.query_params:
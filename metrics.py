@@ -0,0 +1,366 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+)
+MAX_TRACKED_RECORDINGS = 1000
+# USD per million (prompt, cached prompt, completion) tokens
+MODEL_PRICES = {
+    "gpt-4o-2024-08-06": (2.5, 1.25, 10.0),
+    "gpt-4o": (2.5, 1.25, 10.0),
+    "gpt-4o-mini": (0.15, 0.075, 0.6),
+    "gpt-4o-mini-2024-07-18": (0.15, 0.075, 0.6),
+}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: dict | None = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        with self.lock:
+            self.values[_label_key(labels)] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = {}
+        self.sums = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self.lock:
+            counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.sums[key] += value
+
+    def quantile(self, q: float, **labels) -> float | None:
+        """Estimates a quantile by interpolating within the bucket that holds it"""
+        with self.lock:
+            counts = self.counts.get(_label_key(labels))
+            if not counts:
+                return None
+            target = q * sum(counts)
+            seen = 0
+            for i, count in enumerate(counts):
+                if count and seen + count >= target:
+                    lower = self.buckets[i - 1] if i else 0
+                    upper = self.buckets[i] if i < len(self.buckets) else lower
+                    return lower + (upper - lower) * (target - seen) / count
+                seen += count
+            return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, counts in sorted(self.counts.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(key, {'le': bound})} {cumulative}"
+                    )
+                lines.append(f"{self.name}_sum{_format_labels(key)} {self.sums[key]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+CALLS = Counter(
+    "relai_external_calls_total", "External calls by service, operation and status"
+)
+LATENCY = Histogram("relai_external_call_seconds", "External call latency in seconds")
+TOKENS = Counter("relai_llm_tokens_total", "LLM tokens by model, operation and kind")
+CACHE = Counter("relai_llm_cache_total", "LLM response cache lookups by result")
+COST = Counter("relai_llm_cost_usd_total", "Estimated LLM spend in USD")
+PROMPT_TOKENS = Counter(
+    "relai_prompt_transcript_tokens_total",
+    "Transcript tokens sent to the LLM, and what the raw VTT would have cost",
+)
+TIMELINE_MISMATCHES = Counter(
+    "relai_timeline_mismatches_total",
+    "Result intervals whose start did not match an interval marker in the prompt",
+)
+CASCADE = Counter(
+    "relai_model_cascade_total",
+    "Small-model responses accepted, or escalated to the large model by reason",
+)
+METRICS = [
+    CALLS,
+    LATENCY,
+    TOKENS,
+    CACHE,
+    COST,
+    PROMPT_TOKENS,
+    TIMELINE_MISMATCHES,
+    CASCADE,
+]
+
+_recording_stats = OrderedDict()
+_recording_stats_lock = threading.Lock()
+
+
+def token_cost(model: str, prompt: int, cached: int, completion: int) -> float:
+    prices = MODEL_PRICES.get(model)
+    if not prices:
+        return 0.0
+    prompt_price, cached_price, completion_price = prices
+    return (
+        (prompt - cached) * prompt_price
+        + cached * cached_price
+        + completion * completion_price
+    ) / 1e6
+
+
+def _record_for_recording(recording_id: str | None, **amounts) -> None:
+    if not recording_id:
+        return
+    with _recording_stats_lock:
+        stats = _recording_stats.setdefault(recording_id, defaultdict(float))
+        _recording_stats.move_to_end(recording_id)
+        for k, v in amounts.items():
+            stats[k] += v
+        while len(_recording_stats) > MAX_TRACKED_RECORDINGS:
+            _recording_stats.popitem(last=False)
+
+
+def recording_stats() -> dict[str, dict]:
+    with _recording_stats_lock:
+        return {k: dict(v) for k, v in _recording_stats.items()}
+
+
+class Call:
+    def __init__(self, service: str, operation: str, recording_id: str | None) -> None:
+        self.service = service
+        self.operation = operation
+        self.recording_id = recording_id
+
+    def usage(self, model: str, usage) -> None:
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        self.tokens(model, usage.prompt_tokens, usage.completion_tokens, cached)
+
+    def tokens(self, model: str, prompt: int, completion: int, cached: int = 0) -> None:
+        amounts = {"prompt": prompt, "completion": completion, "cached": cached}
+        for kind, amount in amounts.items():
+            TOKENS.inc(amount, model=model, operation=self.operation, kind=kind)
+        cost = token_cost(model, prompt, cached, completion)
+        COST.inc(cost, model=model, operation=self.operation)
+        _record_for_recording(
+            self.recording_id,
+            prompt_tokens=prompt,
+            completion_tokens=completion,
+            cached_tokens=cached,
+            cost_usd=cost,
+        )
+
+
+def cache_lookup(operation: str, hit: bool, recording_id: str | None = None) -> None:
+    result = "hit" if hit else "miss"
+    CACHE.inc(operation=operation, result=result)
+    _record_for_recording(recording_id, **{"cache_hits" if hit else "cache_misses": 1})
+
+
+def record_prompt_encoding(
+    operation: str, raw_tokens: int, encoded_tokens: int, recording_id: str | None
+) -> None:
+    PROMPT_TOKENS.inc(raw_tokens, operation=operation, format="vtt")
+    PROMPT_TOKENS.inc(encoded_tokens, operation=operation, format="encoded")
+    _record_for_recording(
+        recording_id,
+        transcript_vtt_tokens=raw_tokens,
+        transcript_encoded_tokens=encoded_tokens,
+    )
+
+
+def record_timeline_mismatches(
+    operation: str, mismatches: int, recording_id: str | None
+) -> None:
+    if mismatches:
+        TIMELINE_MISMATCHES.inc(mismatches, operation=operation)
+        _record_for_recording(recording_id, timeline_mismatches=mismatches)
+
+
+def record_cascade(operation: str, outcome: str, recording_id: str | None) -> None:
+    CASCADE.inc(operation=operation, outcome=outcome)
+    _record_for_recording(
+        recording_id,
+        **{"cascade_accepted" if outcome == "accepted" else "cascade_escalated": 1},
+    )
+
+
+@contextmanager
+def instrument(
+    service: str, operation: str, recording_id: str | None = None
+) -> Iterator[Call]:
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield Call(service, operation, recording_id)
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        CALLS.inc(service=service, operation=operation, status=status)
+        LATENCY.observe(elapsed, service=service, operation=operation)
+        _record_for_recording(
+            recording_id,
+            calls=1,
+            seconds=elapsed,
+            errors=1 if status == "error" else 0,
+        )
+
+
+def instrumented(service: str) -> Callable:
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with instrument(service, fn.__name__):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def render_prometheus() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+def operation_stats() -> list[dict]:
+    with CALLS.lock:
+        calls = dict(CALLS.values)
+    rows = defaultdict(lambda: {"calls": 0, "errors": 0})
+    for key, value in calls.items():
+        labels = dict(key)
+        row = rows[(labels["service"], labels["operation"])]
+        row["calls"] += value
+        if labels["status"] == "error":
+            row["errors"] += value
+    rv = []
+    for (service, operation), row in sorted(rows.items()):
+        with LATENCY.lock:
+            total = LATENCY.sums[
+                _label_key({"service": service, "operation": operation})
+            ]
+        rv.append(
+            {
+                "service": service,
+                "operation": operation,
+                **row,
+                "mean_secs": total / row["calls"] if row["calls"] else None,
+                "p50_secs": LATENCY.quantile(0.5, service=service, operation=operation),
+                "p95_secs": LATENCY.quantile(
+                    0.95, service=service, operation=operation
+                ),
+            }
+        )
+    return rv
+
+
+def cascade_stats() -> list[dict]:
+    """Small-model responses per operation, how many were accepted and how many
+    were escalated to the large model for each reason"""
+    with CASCADE.lock:
+        counts = dict(CASCADE.values)
+    rows = defaultdict(lambda: {"accepted": 0, "escalated": 0})
+    for key, value in counts.items():
+        labels = dict(key)
+        row = rows[labels["operation"]]
+        if labels["outcome"] == "accepted":
+            row["accepted"] += value
+        else:
+            row["escalated"] += value
+            row[labels["outcome"]] = row.get(labels["outcome"], 0) + value
+    rv = []
+    for operation, row in sorted(rows.items()):
+        total = row["accepted"] + row["escalated"]
+        rv.append(
+            {
+                "operation": operation,
+                **row,
+                "escalation_rate": row["escalated"] / total if total else None,
+            }
+        )
+    return rv
+
+
+def token_stats() -> list[dict]:
+    """Token totals and spend per model and operation, with the share of prompt
+    tokens served from the provider's prompt cache"""
+    with TOKENS.lock:
+        tokens = dict(TOKENS.values)
+    with COST.lock:
+        costs = dict(COST.values)
+    rows = defaultdict(lambda: {"prompt": 0, "cached": 0, "completion": 0})
+    for key, value in tokens.items():
+        labels = dict(key)
+        rows[(labels["model"], labels["operation"])][labels["kind"]] += value
+    rv = []
+    for (model, operation), row in sorted(rows.items()):
+        rv.append(
+            {
+                "model": model,
+                "operation": operation,
+                **row,
+                "cached_share": (
+                    row["cached"] / row["prompt"] if row["prompt"] else None
+                ),
+                "cost_usd": costs.get(
+                    _label_key({"model": model, "operation": operation}), 0.0
+                ),
+            }
+        )
+    return rv
@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import defaultdict
+
+
+class CoupleNotifier:
+    """Announces changes to a user's couple or partner confirmation state"""
+
+    def publish(self, *user_ids: str) -> None:
+        raise NotImplementedError
+
+    def version(self, user_id: str) -> int:
+        raise NotImplementedError
+
+
+class LocalCoupleNotifier(CoupleNotifier):
+    """In-process notifier shared by all sessions served by this process"""
+
+    def __init__(self) -> None:
+        self.versions = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def publish(self, *user_ids: str) -> None:
+        with self.lock:
+            for user_id in user_ids:
+                if user_id:
+                    self.versions[user_id] += 1
+
+    def version(self, user_id: str) -> int:
+        with self.lock:
+            return self.versions.get(user_id, 0)
+
+
+class BackoffPoller:
+    """Decides when a fallback poll is due, doubling the delay after every poll"""
+
+    def __init__(
+        self, initial_secs: float = 1, max_secs: float = 60, factor: float = 2
+    ) -> None:
+        self.initial_secs = initial_secs
+        self.max_secs = max_secs
+        self.factor = factor
+        self.delay_secs = initial_secs
+        self.next_at = 0.0
+
+    def due(self) -> bool:
+        return time.monotonic() >= self.next_at
+
+    def backoff(self) -> None:
+        self.next_at = time.monotonic() + self.delay_secs
+        self.delay_secs = min(self.delay_secs * self.factor, self.max_secs)
+
+    def reset(self) -> None:
+        self.delay_secs = self.initial_secs
+        self.next_at = 0.0
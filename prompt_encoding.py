@@ -0,0 +1,112 @@
+import re
+from functools import lru_cache
+import tiktoken
+from transcript import Transcript, format_timestamp, timestamp_ms
+
+DEFAULT_ENCODING = "o200k_base"
+# speaker labels up to this long are sent as they are
+MAX_SPEAKER_ID_LEN = 3
+
+
+def speaker_ids(speakers: list[str]) -> dict[str, str]:
+    """Short id of each speaker for prompts: short labels are kept, and when any
+    speaker has a longer name, such as a Zoom display name, all become S1, S2, ..."""
+    if all(len(s) <= MAX_SPEAKER_ID_LEN for s in speakers):
+        return {s: s for s in speakers}
+    return {s: f"S{i + 1}" for i, s in enumerate(speakers)}
+
+
+def restore_speaker_names(text: str, ids: dict[str, str]) -> str:
+    """Replaces the short speaker ids of a prompt with the speakers' names"""
+    names = {i: s for s, i in ids.items() if i != s}
+    if not names:
+        return text
+    pattern = r"\b(" + "|".join(re.escape(i) for i in names) + r")\b"
+    return re.sub(pattern, lambda m: names[m.group(1)], text)
+
+
+def encode_transcript(
+    transcript: Transcript, interval_ms: int, short_ids: bool = True
+) -> str:
+    """Renders cues as speaker turns, merging consecutive cues of one speaker,
+    with a [HH:MM:SS] marker (offset from the start of the recording) only where
+    an interval begins. With short_ids, speakers are named by speaker_ids and a
+    first line maps the ids to the names"""
+    ids = (
+        speaker_ids(transcript.speakers)
+        if short_ids
+        else {s: s for s in transcript.speakers}
+    )
+    lines = []
+    legend = [f"{i} = {s}" for s, i in ids.items() if i != s]
+    if legend:
+        lines.append(f"Speakers: {', '.join(legend)}")
+    turn_speaker, turn_texts = None, []
+    next_boundary = None
+
+    def flush() -> None:
+        if turn_texts:
+            name = ids.get(turn_speaker)
+            text = " ".join(turn_texts)
+            lines.append(f"{name}: {text}" if name else text)
+            turn_texts.clear()
+
+    for i in range(len(transcript)):
+        start_ms = transcript.start_ms[i]
+        if next_boundary is None or start_ms >= next_boundary:
+            flush()
+            boundary = start_ms // interval_ms * interval_ms
+            lines.append(f"[{format_timestamp(boundary, False)}]")
+            next_boundary = boundary + interval_ms
+            turn_speaker = None
+        speaker = transcript.speaker_at(i)
+        if speaker != turn_speaker:
+            flush()
+            turn_speaker = speaker
+        turn_texts.append(transcript.text_at(i).strip())
+    flush()
+    return "\n".join(lines)
+
+
+def interval_boundaries(encoded: str) -> set[int]:
+    return {
+        timestamp_ms(line[1:-1])
+        for line in encoded.splitlines()
+        if line.startswith("[") and line.endswith("]")
+    }
+
+
+def timeline_mismatches(items: list, boundaries: set[int]) -> int:
+    """Counts result intervals whose start_time is not one of the interval markers
+    the model was shown, i.e. that do not map back onto the original timeline"""
+    mismatches = 0
+    for item in items:
+        try:
+            start_ms = timestamp_ms(item.start_time)
+        except ValueError:
+            mismatches += 1
+            continue
+        if start_ms not in boundaries:
+            mismatches += 1
+    return mismatches
+
+
+@lru_cache
+def _encoding(model: str) -> tiktoken.Encoding | None:
+    try:
+        name = tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        name = DEFAULT_ENCODING
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        # tiktoken downloads its vocabularies on first use; measuring is not worth
+        # failing an analysis over
+        return None
+
+
+def num_tokens(text: str, model: str) -> int | None:
+    encoding = _encoding(model)
+    if encoding is None:
+        return None
+    return len(encoding.encode(text, disallowed_special=()))
@@ -1,8 +1,33 @@
-from chatbot import EmotionAnalysis, ModeAnalysis
-from openai import OpenAI
+from chatbot import CombinedAnalysis, EmotionAnalysis, ModeAnalysis
 from chatbot import Chatbot
 from datetime import datetime
 from store import DBClient
+from llm_cache import ParseStream, cached_parse
+from cascade import ModelCascade
+from metrics import record_prompt_encoding, record_timeline_mismatches
+from prompt_encoding import (
+    encode_transcript,
+    interval_boundaries,
+    num_tokens,
+    restore_speaker_names,
+    speaker_ids,
+    timeline_mismatches,
+)
+from concurrent.futures import ThreadPoolExecutor
+from transcript import Transcript, timestamp_ms, format_timestamp
+from typing import Callable
+from pydantic import BaseModel
+import hashlib
+import json
+
+WINDOW_INTERVALS = 10
+WINDOW_OVERLAP_SECS = 30
+MAX_WINDOW_WORKERS = 8
+# bump when a change to the prompts or schemas should invalidate stored windows
+PROMPT_VERSION = 1
+# transcripts are marked every minute whatever the interval, so one recording's
+# prompts share the same transcript prefix at every interval
+MARKER_INTERVAL_MS = 60 * 1000
 
 
 class RecordingProcessor:
@@ -10,37 +35,322 @@ class RecordingProcessor:
         self,
         id: str,
         ts: datetime,
-        transcript: str,
+        transcript: str | None,
         chatbot: Chatbot,
         db_client: DBClient,
+        transcript_compact: str | None = None,
+        cascade: ModelCascade | None = None,
     ) -> None:
         self.id = id
         self.ts = ts
-        self.transcript = transcript
+        self._transcript = transcript
+        self._transcript_compact = transcript_compact
+        self._transcript_data = None
         self.chatbot = chatbot
         self.db_client = db_client
+        self.cascade = cascade
         self.duration_secs = 0
 
     @property
     def date(self) -> str:
         return self.ts.date().isoformat()
 
-    def get_emotion_analysis(self, interval: int) -> EmotionAnalysis:
-        prompt = f"Following is a transcript of a group discussion with timestamps. For every interval of {interval} minutes, perform emotion analysis, choosing emotion labels from the given list. \n\n {self.transcript}"
-        messages = [{"role": "user", "content": prompt}]
-        response = OpenAI().beta.chat.completions.parse(
+    def _load_transcript(self) -> None:
+        if self._transcript is None:
+            self._set_transcripts(self.db_client.get_transcript(self.id))
+
+    def _set_transcripts(self, transcripts: dict) -> None:
+        self._transcript = transcripts["transcript"]
+        self._transcript_compact = transcripts.get("transcript_compact")
+
+    @staticmethod
+    def load_transcripts(processors: list["RecordingProcessor"]) -> None:
+        """Loads the transcripts that processors have not loaded yet in one query"""
+        pending = [rp for rp in processors if rp._transcript is None]
+        if not pending:
+            return
+        transcripts = pending[0].db_client.get_transcripts([rp.id for rp in pending])
+        for rp in pending:
+            if rp.id in transcripts:
+                rp._set_transcripts(transcripts[rp.id])
+
+    @property
+    def transcript(self) -> str:
+        self._load_transcript()
+        return self._transcript
+
+    @property
+    def transcript_data(self) -> Transcript:
+        if self._transcript_data is None:
+            self._load_transcript()
+            if self._transcript_compact:
+                self._transcript_data = Transcript.decode(self._transcript_compact)
+            else:
+                self._transcript_data = Transcript.from_vtt(self._transcript)
+        return self._transcript_data
+
+    def _emotion_prompt(self, interval: int, scope: str = "") -> str:
+        return f"For every interval of {interval} minutes{scope} of the transcript above, perform emotion analysis, choosing emotion labels from the given list. Use the markers as start times."
+
+    def _mode_prompt(self, interval: int, scope: str = "") -> str:
+        return f"For every interval of {interval} minutes{scope} of the transcript above, classify it as a mode, choosing mode labels from the given list. Use the markers as start times."
+
+    def _combined_prompt(self, interval: int, scope: str = "") -> str:
+        return f"For every interval of {interval} minutes{scope} of the transcript above, classify it as a mode, choosing a mode label from the given list, and perform emotion analysis, choosing emotion labels from the given list. Use the markers as start times."
+
+    def _messages(self, transcript: str, instructions: str) -> list[dict]:
+        # the transcript leads so that every analysis of the same recording, at
+        # any interval, shares it as a prefix the provider can cache
+        return [
+            {
+                "role": "user",
+                "content": f"Following is a transcript of a conversation between a couple as speaker turns. Each [HH:MM:SS] marker starts a minute, as an offset from the start of the recording.\n\n{transcript}",
+            },
+            {"role": "user", "content": instructions},
+        ]
+
+    def _encode(self, transcript: Transcript) -> str:
+        return encode_transcript(transcript, MARKER_INTERVAL_MS)
+
+    def _name_speakers(self, items: list) -> list:
+        """Names the speakers that each item's reasoning refers to by prompt id"""
+        ids = speaker_ids(self.transcript_data.speakers)
+        for item in items:
+            item.reasoning = restore_speaker_names(item.reasoning, ids)
+        return items
+
+    def _record_encoding(
+        self, operation: str, transcript: Transcript, encoded: str
+    ) -> None:
+        model = self.chatbot.model_id
+        encoded_tokens = num_tokens(encoded, model)
+        if encoded_tokens is not None:
+            record_prompt_encoding(
+                operation,
+                num_tokens(transcript.to_vtt(), model),
+                encoded_tokens,
+                self.id,
+            )
+
+    def _boundaries(self, encoded: str, interval: int) -> set[int]:
+        interval_ms = interval * 60 * 1000
+        return {b for b in interval_boundaries(encoded) if not b % interval_ms}
+
+    def _record_mismatches(
+        self, operation: str, interval: int, pairs: list[tuple[str, list]]
+    ) -> None:
+        record_timeline_mismatches(
+            operation,
+            sum(
+                timeline_mismatches(items, self._boundaries(encoded, interval))
+                for encoded, items in pairs
+            ),
+            self.id,
+        )
+
+    @property
+    def model_key(self) -> str:
+        return self.cascade.name if self.cascade else self.chatbot.model_id
+
+    def _parse(
+        self,
+        messages: list[dict],
+        response_format: type,
+        field: str,
+        boundaries: set[int],
+    ):
+        if self.cascade:
+            return self.cascade.parse(
+                messages,
+                response_format,
+                field,
+                boundaries,
+                operation=response_format.__name__,
+                recording_id=self.id,
+            )
+        return cached_parse(
+            self.chatbot.client,
             model=self.chatbot.model_id,
             messages=messages,
-            response_format=EmotionAnalysis,
+            response_format=response_format,
+            temperature=self.chatbot.temperature,
+            operation=response_format.__name__,
+            recording_id=self.id,
+        )
+
+    def _analyze(
+        self,
+        interval: int,
+        build_prompt: Callable[[int], str],
+        response_format: type[BaseModel],
+        field: str,
+    ) -> BaseModel:
+        operation = response_format.__name__
+        encoded = self._encode(self.transcript_data)
+        self._record_encoding(operation, self.transcript_data, encoded)
+        analysis = self._parse(
+            self._messages(encoded, build_prompt(interval)),
+            response_format,
+            field,
+            self._boundaries(encoded, interval),
+        )
+        items = self._name_speakers(getattr(analysis, field))
+        self._record_mismatches(operation, interval, [(encoded, items)])
+        return analysis
+
+    def get_emotion_analysis(self, interval: int) -> EmotionAnalysis:
+        return self._analyze(
+            interval, self._emotion_prompt, EmotionAnalysis, "emotions"
         )
-        return response.choices[0].message.parsed
 
     def get_mode_analysis(self, interval: int) -> ModeAnalysis:
-        prompt = f"Following is a transcript with timestamps of a conversation between a couple. For every interval of {interval} minutes, classify it as a mode, choosing mode labels from the given list. \n\n {self.transcript}"
-        messages = [{"role": "user", "content": prompt}]
-        response = OpenAI().beta.chat.completions.parse(
+        return self._analyze(interval, self._mode_prompt, ModeAnalysis, "modes")
+
+    def stream_combined_analysis(self, interval: int) -> ParseStream:
+        """Whole-transcript combined analysis that yields intervals as they are
+        generated; the validated CombinedAnalysis is on .result afterwards"""
+        operation = CombinedAnalysis.__name__
+        encoded = self._encode(self.transcript_data)
+        self._record_encoding(operation, self.transcript_data, encoded)
+        return ParseStream(
+            self.chatbot.client,
             model=self.chatbot.model_id,
-            messages=messages,
-            response_format=ModeAnalysis,
+            messages=self._messages(encoded, self._combined_prompt(interval)),
+            response_format=CombinedAnalysis,
+            field="intervals",
+            temperature=self.chatbot.temperature,
+            operation=operation,
+            recording_id=self.id,
+            postprocess=lambda result: self._name_speakers(result.intervals),
         )
-        return response.choices[0].message.parsed
+
+    def get_windowed_emotion_analysis(self, interval: int) -> EmotionAnalysis:
+        emotions = self._analyze_windows(
+            interval,
+            lambda scope: self._emotion_prompt(interval, scope),
+            EmotionAnalysis,
+            "emotions",
+        )
+        return EmotionAnalysis(emotions=emotions)
+
+    def get_windowed_mode_analysis(self, interval: int) -> ModeAnalysis:
+        modes = self._analyze_windows(
+            interval,
+            lambda scope: self._mode_prompt(interval, scope),
+            ModeAnalysis,
+            "modes",
+        )
+        return ModeAnalysis(modes=modes)
+
+    def get_windowed_combined_analysis(self, interval: int) -> CombinedAnalysis:
+        intervals = self._analyze_windows(
+            interval,
+            lambda scope: self._combined_prompt(interval, scope),
+            CombinedAnalysis,
+            "intervals",
+        )
+        return CombinedAnalysis(intervals=intervals)
+
+    def _window_hash(self, messages: list[dict], response_format: type) -> str:
+        prompt = json.dumps(messages, sort_keys=True)
+        key = (
+            f"{PROMPT_VERSION}\n{self.model_key}\n{response_format.__name__}\n{prompt}"
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _analyze_windows(
+        self,
+        interval: int,
+        build_prompt: Callable[[str], str],
+        response_format: type[BaseModel],
+        field: str,
+    ) -> list:
+        interval_ms = interval * 60 * 1000
+        windows = self.transcript_data.windows(
+            WINDOW_INTERVALS * interval_ms, WINDOW_OVERLAP_SECS * 1000
+        )
+        if not windows:
+            return []
+        duration_ms = self.transcript_data.duration_ms
+        operation = response_format.__name__
+
+        encodings = [self._encode(w.transcript) for w in windows]
+        prompts = [
+            self._messages(
+                encoded,
+                build_prompt(
+                    f" from {format_timestamp(w.start_ms, False)} to {format_timestamp(w.end_ms, False)}"
+                ),
+            )
+            for w, encoded in zip(windows, encodings)
+        ]
+        hashes = [self._window_hash(p, response_format) for p in prompts]
+        cached = self.db_client.get_window_analyses(hashes)
+        pending = [
+            (h, w, p, e)
+            for h, w, p, e in zip(hashes, windows, prompts, encodings)
+            if h not in cached
+        ]
+        if pending:
+            for _, w, _, encoded in pending:
+                self._record_encoding(operation, w.transcript, encoded)
+            with ThreadPoolExecutor(
+                max_workers=min(MAX_WINDOW_WORKERS, len(pending))
+            ) as executor:
+                results = list(
+                    executor.map(
+                        lambda pending_window: self._name_speakers(
+                            getattr(
+                                self._parse(
+                                    pending_window[2],
+                                    response_format,
+                                    field,
+                                    self._boundaries(pending_window[3], interval),
+                                ),
+                                field,
+                            )
+                        ),
+                        pending,
+                    )
+                )
+            rows = [
+                {
+                    "hash": h,
+                    "recording_id": self.id,
+                    "start_ms": w.start_ms,
+                    "items": [item.model_dump(mode="json") for item in items],
+                }
+                for (h, w, _, _), items in zip(pending, results)
+            ]
+            self._record_mismatches(
+                operation,
+                interval,
+                [
+                    (encoded, items)
+                    for (_, _, _, encoded), items in zip(pending, results)
+                ],
+            )
+            self.db_client.insert_window_analyses(rows)
+            cached.update({row["hash"]: row["items"] for row in rows})
+
+        merged = {}
+        for window, h in zip(windows, hashes):
+            items = getattr(response_format.model_validate({field: cached[h]}), field)
+            for item in items:
+                try:
+                    idx = round(timestamp_ms(item.start_time) / interval_ms)
+                except ValueError:
+                    continue
+                start_ms = idx * interval_ms
+                if window.start_ms <= start_ms < min(window.end_ms, duration_ms):
+                    merged.setdefault(idx, item)
+
+        rv = []
+        for idx in sorted(merged):
+            item = merged[idx]
+            item.start_time = format_timestamp(idx * interval_ms, False)
+            item.end_time = format_timestamp(
+                min((idx + 1) * interval_ms, duration_ms), False
+            )
+            rv.append(item)
+        return rv
@@ -0,0 +1,111 @@
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from chat_memory import count_tokens
+from prompt_encoding import encode_transcript
+from recording_processor import MARKER_INTERVAL_MS, RecordingProcessor
+
+PASSAGE_MS = 5 * 60 * 1000
+PASSAGE_OVERLAP_MS = 30 * 1000
+CONTEXT_TOKEN_BUDGET = 1500
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_WORD = re.compile(r"\w+")
+
+
+def _terms(text: str) -> list[str]:
+    return _WORD.findall(text.lower())
+
+
+@dataclass
+class Passage:
+    recording_id: str
+    ts: str
+    start_ms: int
+    text: str
+    terms: Counter
+    length: int
+
+    def render(self) -> str:
+        return f"Recording of {self.ts}:\n{self.text}"
+
+
+class TranscriptRetriever:
+    """BM25 index over fixed windows of a couple's transcripts, used to ground
+    chat answers in the passages that match a question"""
+
+    def __init__(
+        self,
+        processors: list[RecordingProcessor],
+        passage_ms: int = PASSAGE_MS,
+        overlap_ms: int = PASSAGE_OVERLAP_MS,
+    ) -> None:
+        self.processors = processors
+        self.passage_ms = passage_ms
+        self.overlap_ms = overlap_ms
+        self._passages = None
+        self.doc_freq = Counter()
+        self.avg_length = 0.0
+
+    @property
+    def passages(self) -> list[Passage]:
+        # transcripts are only loaded the first time the chat needs context
+        if self._passages is None:
+            RecordingProcessor.load_transcripts(self.processors)
+            passages = []
+            for rp in self.processors:
+                for w in rp.transcript_data.windows(self.passage_ms, self.overlap_ms):
+                    # passages name the speakers in full, without a legend
+                    text = encode_transcript(
+                        w.transcript, MARKER_INTERVAL_MS, short_ids=False
+                    )
+                    terms = Counter(_terms(text))
+                    passages.append(
+                        Passage(
+                            rp.id,
+                            str(rp.ts),
+                            w.start_ms,
+                            text,
+                            terms,
+                            sum(terms.values()),
+                        )
+                    )
+            for p in passages:
+                self.doc_freq.update(p.terms.keys())
+            self.avg_length = sum(p.length for p in passages) / max(1, len(passages))
+            self._passages = passages
+        return self._passages
+
+    def _score(self, passage: Passage, query: set[str]) -> float:
+        n = len(self._passages)
+        score = 0.0
+        for term in query:
+            tf = passage.terms.get(term)
+            if not tf:
+                continue
+            idf = math.log(
+                1 + (n - self.doc_freq[term] + 0.5) / (self.doc_freq[term] + 0.5)
+            )
+            norm = K1 * (1 - B + B * passage.length / (self.avg_length or 1))
+            score += idf * tf * (K1 + 1) / (tf + norm)
+        return score
+
+    def search(
+        self, query: str, model: str, token_budget: int = CONTEXT_TOKEN_BUDGET
+    ) -> list[Passage]:
+        """Best matching passages, in order of relevance, that fit token_budget"""
+        terms = set(_terms(query))
+        scored = [(self._score(p, terms), p) for p in self.passages]
+        rv = []
+        for score, passage in sorted(scored, key=lambda s: s[0], reverse=True):
+            if score <= 0:
+                break
+            tokens = count_tokens(passage.render(), model)
+            if tokens > token_budget:
+                continue
+            rv.append(passage)
+            token_budget -= tokens
+        return rv
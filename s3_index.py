@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, insort
+
+DEFAULT_INDEX_PATH = ".s3_key_index.sqlite3"
+# incremental syncs only see keys sorting after the last one listed, so the whole
+# prefix is re-listed this often to pick up other new keys and deletions
+FULL_SYNC_SECS = 3600
+
+
+class S3KeyIndex:
+    """Local SQLite copy of a bucket's keys, kept in sync through the
+    list_objects_v2 paginator and answered from a sorted in-memory list"""
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str | None = None,
+        path: str = DEFAULT_INDEX_PATH,
+        full_sync_secs: float = FULL_SYNC_SECS,
+    ) -> None:
+        self.s3 = s3_client
+        self.bucket = bucket or os.getenv("S3_BUCKET")
+        self.full_sync_secs = full_sync_secs
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS s3_keys (bucket TEXT NOT NULL, key TEXT NOT NULL, size INTEGER NOT NULL, last_modified REAL NOT NULL, PRIMARY KEY (bucket, key))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS s3_sync (bucket TEXT NOT NULL, prefix TEXT NOT NULL, start_after TEXT, last_modified REAL NOT NULL, full_synced_at REAL NOT NULL, PRIMARY KEY (bucket, prefix))"
+        )
+        self.db.commit()
+        self.sorted_keys = [
+            row[0]
+            for row in self.db.execute(
+                "SELECT key FROM s3_keys WHERE bucket = ? ORDER BY key", (self.bucket,)
+            )
+        ]
+
+    def _list(self, prefix: str, start_after: str | None):
+        kwargs = {"Bucket": self.bucket, "Prefix": prefix}
+        if start_after:
+            kwargs["StartAfter"] = start_after
+        for page in self.s3.get_paginator("list_objects_v2").paginate(**kwargs):
+            yield from page.get("Contents", [])
+
+    def sync(self, prefix: str = "", full: bool | None = None) -> int:
+        """Lists keys added under prefix since the last sync and returns how many
+        rows changed; a full sync also drops keys deleted from the bucket"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT start_after, last_modified, full_synced_at FROM s3_sync WHERE bucket = ? AND prefix = ?",
+                (self.bucket, prefix),
+            ).fetchone()
+            start_after, watermark, full_synced_at = row or (None, 0.0, 0.0)
+            now = time.time()
+            if full is None:
+                full = now - full_synced_at >= self.full_sync_secs
+            if full:
+                start_after = None
+                full_synced_at = now
+
+            listed = set()
+            changed = []
+            last_key = start_after
+            max_modified = watermark
+            for obj in self._list(prefix, start_after):
+                modified = obj["LastModified"].timestamp()
+                listed.add(obj["Key"])
+                last_key = max(last_key or obj["Key"], obj["Key"])
+                max_modified = max(max_modified, modified)
+                # unchanged objects older than the watermark are already indexed
+                if modified > watermark or obj["Key"] not in self:
+                    changed.append((self.bucket, obj["Key"], obj["Size"], modified))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO s3_keys (bucket, key, size, last_modified) VALUES (?, ?, ?, ?)",
+                changed,
+            )
+            new_keys = [key for _, key, _, _ in changed if key not in self]
+            if new_keys:
+                # timsort merges the already sorted runs in linear time
+                self.sorted_keys = sorted(self.sorted_keys + new_keys)
+
+            deleted = []
+            if full:
+                deleted = [k for k in self._with_prefix(prefix) if k not in listed]
+                self.db.executemany(
+                    "DELETE FROM s3_keys WHERE bucket = ? AND key = ?",
+                    [(self.bucket, k) for k in deleted],
+                )
+                deleted_set = set(deleted)
+                self.sorted_keys = [k for k in self.sorted_keys if k not in deleted_set]
+
+            self.db.execute(
+                "INSERT OR REPLACE INTO s3_sync (bucket, prefix, start_after, last_modified, full_synced_at) VALUES (?, ?, ?, ?, ?)",
+                (self.bucket, prefix, last_key, max_modified, full_synced_at),
+            )
+            self.db.commit()
+            return len(changed) + len(deleted)
+
+    def add(self, key: str, size: int = 0) -> None:
+        """Records a key this process just wrote, without waiting for a sync"""
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO s3_keys (bucket, key, size, last_modified) VALUES (?, ?, ?, ?)",
+                (self.bucket, key, size, time.time()),
+            )
+            self.db.commit()
+            self._add(key)
+
+    def _add(self, key: str) -> None:
+        if key not in self:
+            insort(self.sorted_keys, key)
+
+    def _with_prefix(self, prefix: str) -> list[str]:
+        start = bisect_left(self.sorted_keys, prefix)
+        end = bisect_left(self.sorted_keys, prefix + "\U0010ffff", lo=start)
+        return self.sorted_keys[start:end]
+
+    def keys(self, prefix: str = "") -> list[str]:
+        with self.lock:
+            return self._with_prefix(prefix)
+
+    def __contains__(self, key: str) -> bool:
+        i = bisect_left(self.sorted_keys, key)
+        return i < len(self.sorted_keys) and self.sorted_keys[i] == key
@@ -1,23 +1,58 @@
-from supabase import create_client, Client
+from typing import Callable
+from supabase import Client
+from metrics import instrumented
+
+IN_FILTER_BATCH_SIZE = 100
+PAGE_SIZE = 1000
 
 
 class DBClient:
-    def __init__(self, supabase_url: str, supabase_key: str) -> Client:
-        self.client = create_client(supabase_url, supabase_key)
+    def __init__(
+        self, client: Client, auth_client_factory: Callable[[], Client] | None = None
+    ) -> None:
+        self.client = client
+        self.auth_client_factory = auth_client_factory
+
+    def _select_in(
+        self, table: str, columns: str, column: str, values: list, **filters
+    ) -> list[dict]:
+        rows = []
+        for i in range(0, len(values), IN_FILTER_BATCH_SIZE):
+            batch = values[i : i + IN_FILTER_BATCH_SIZE]
+            start = 0
+            while True:
+                query = self.client.table(table).select(columns).in_(column, batch)
+                for k, v in filters.items():
+                    query = query.eq(k, v)
+                page = query.range(start, start + PAGE_SIZE - 1).execute().data
+                rows.extend(page)
+                if len(page) < PAGE_SIZE:
+                    break
+                start += PAGE_SIZE
+        return rows
 
+    @instrumented("supabase")
     def sign_in(self, email: str, password: str):
-        return self.client.auth.sign_in_with_password(
+        # signing in stores the user session on the client, so it must not
+        # happen on the shared client
+        auth_client = (
+            self.auth_client_factory() if self.auth_client_factory else self.client
+        )
+        return auth_client.auth.sign_in_with_password(
             {"email": email, "password": password}
         ).user
 
+    @instrumented("supabase")
     def get_user(self, user_id: str):
         return self.client.auth.admin.get_user_by_id(user_id).user
 
+    @instrumented("supabase")
     def update_user_password(self, user_id: str, password: str):
         return self.client.auth.admin.update_user_by_id(
             user_id, {"password": password}
         ).user
 
+    @instrumented("supabase")
     def invite_user_by_email(self, email: str, first_name: str, last_name: str):
         return self.client.auth.admin.invite_user_by_email(
             email,
@@ -29,32 +64,27 @@ class DBClient:
             },
         ).user
 
+    @instrumented("supabase")
     def insert_couple(self, user_id: str, partner_id: str | None = None) -> None:
         self.client.table("couple").insert(
             {"user_id": user_id, "partner_id": partner_id}
         ).execute()
 
+    @instrumented("supabase")
     def get_couple(self, user_id: str) -> dict | None:
-        by_user_id = (
-            self.client.table("couple")
-            .select("*")
-            .eq("user_id", user_id)
-            .maybe_single()
-            .execute()
-        )
-        if by_user_id:
-            return by_user_id.data
-        by_partner_id = (
+        couple = (
             self.client.table("couple")
             .select("*")
-            .eq("partner_id", user_id)
+            .or_(f"user_id.eq.{user_id},partner_id.eq.{user_id}")
+            .limit(1)
             .maybe_single()
             .execute()
         )
-        if by_partner_id:
-            return by_partner_id.data
+        if couple:
+            return couple.data
         return None
 
+    @instrumented("supabase")
     def get_mode_analysis(self, recording_id: str) -> dict | None:
         mode_analysis = (
             self.client.table("mode_analysis")
@@ -67,14 +97,24 @@ class DBClient:
             return mode_analysis.data["modes"]
         return None
 
+    @instrumented("supabase")
+    def get_mode_analyses(self, recording_ids: list[str]) -> dict[str, dict]:
+        rows = self._select_in(
+            "mode_analysis", "recording_id, modes", "recording_id", recording_ids
+        )
+        return {row["recording_id"]: row["modes"] for row in rows}
+
+    @instrumented("supabase")
     def insert_mode_analysis(self, recording_id: str, json: dict) -> None:
-        self.client.table("mode_analysis").insert(
+        self.client.table("mode_analysis").upsert(
             {
                 "recording_id": recording_id,
                 "modes": json,
-            }
+            },
+            on_conflict="recording_id",
         ).execute()
 
+    @instrumented("supabase")
     def get_emotion_analysis(self, recording_id: str, interval: int) -> dict | None:
         emotion_analysis = (
             self.client.table("emotion_analysis")
@@ -88,17 +128,108 @@ class DBClient:
             return emotion_analysis.data["emotion_analysis"]
         return None
 
+    @instrumented("supabase")
+    def get_emotion_analyses(
+        self, recording_ids: list[str], interval: int
+    ) -> dict[str, dict]:
+        rows = self._select_in(
+            "emotion_analysis",
+            "recording_id, emotion_analysis",
+            "recording_id",
+            recording_ids,
+            interval=interval,
+        )
+        return {row["recording_id"]: row["emotion_analysis"] for row in rows}
+
+    @instrumented("supabase")
     def insert_emotion_analysis(
         self, recording_id: str, interval: int, json: dict
     ) -> None:
-        self.client.table("emotion_analysis").insert(
+        self.client.table("emotion_analysis").upsert(
             {
                 "recording_id": recording_id,
                 "interval": interval,
                 "emotion_analysis": json,
-            }
+            },
+            on_conflict="recording_id,interval",
         ).execute()
 
+    @instrumented("supabase")
+    def get_window_analyses(self, hashes: list[str]) -> dict[str, list]:
+        rows = self._select_in("window_analysis", "hash, items", "hash", hashes)
+        return {row["hash"]: row["items"] for row in rows}
+
+    @instrumented("supabase")
+    def insert_window_analyses(self, rows: list[dict]) -> None:
+        if rows:
+            self.client.table("window_analysis").upsert(
+                rows, on_conflict="hash"
+            ).execute()
+
+    @instrumented("supabase")
+    def get_chat_memory(self, couple_id: str) -> dict | None:
+        chat_memory = (
+            self.client.table("chat_memory")
+            .select("memory")
+            .eq("couple_id", couple_id)
+            .maybe_single()
+            .execute()
+        )
+        if chat_memory:
+            return chat_memory.data["memory"]
+        return None
+
+    @instrumented("supabase")
+    def upsert_chat_memory(self, couple_id: str, memory: dict) -> None:
+        self.client.table("chat_memory").upsert(
+            {"couple_id": couple_id, "memory": memory}, on_conflict="couple_id"
+        ).execute()
+
+    @instrumented("supabase")
+    def get_recording_metadata(
+        self, couple_id: str, offset: int, limit: int
+    ) -> list[dict]:
+        return (
+            self.client.table("recording")
+            .select("id, created_at")
+            .eq("couple_id", couple_id)
+            .order("created_at", desc=True)
+            .range(offset, offset + limit - 1)
+            .execute()
+            .data
+        )
+
+    @instrumented("supabase")
+    def count_recordings(self, couple_id: str) -> int:
+        return (
+            self.client.table("recording")
+            .select("id", count="exact", head=True)
+            .eq("couple_id", couple_id)
+            .execute()
+            .count
+        )
+
+    @instrumented("supabase")
+    def get_transcript(self, recording_id: str) -> dict | None:
+        transcript = (
+            self.client.table("recording")
+            .select("transcript, transcript_compact")
+            .eq("id", recording_id)
+            .maybe_single()
+            .execute()
+        )
+        if transcript:
+            return transcript.data
+        return None
+
+    @instrumented("supabase")
+    def get_transcripts(self, recording_ids: list[str]) -> dict[str, dict]:
+        rows = self._select_in(
+            "recording", "id, transcript, transcript_compact", "id", recording_ids
+        )
+        return {row["id"]: row for row in rows}
+
+    @instrumented("supabase")
     def get_recordings(self, couple_id: str) -> list[dict]:
         return (
             self.client.table("recording")
@@ -108,6 +239,7 @@ class DBClient:
             .data
         )
 
+    @instrumented("supabase")
     def get_classes(self, teacher_id: str) -> list[dict]:
         return (
             self.client.table("classes")
@@ -117,6 +249,7 @@ class DBClient:
             .data
         )
 
+    @instrumented("supabase")
     def get_speakers(self, class_id: str) -> dict:
         return (
             self.client.table("speakers")
@@ -126,10 +259,73 @@ class DBClient:
             .data
         )
 
-    def insert_recording(self, couple_id: str, transcript: str) -> None:
-        self.client.table("recording").insert(
+    @instrumented("supabase")
+    def get_recording(self, recording_id: str) -> dict | None:
+        recording = (
+            self.client.table("recording")
+            .select("*")
+            .eq("id", recording_id)
+            .maybe_single()
+            .execute()
+        )
+        if recording:
+            return recording.data
+        return None
+
+    @instrumented("supabase")
+    def insert_recording(
+        self, couple_id: str, transcript: str, transcript_compact: str | None = None
+    ) -> str:
+        return (
+            self.client.table("recording")
+            .insert(
+                {
+                    "couple_id": couple_id,
+                    "transcript": transcript,
+                    "transcript_compact": transcript_compact,
+                }
+            )
+            .execute()
+            .data[0]["id"]
+        )
+
+    @instrumented("supabase")
+    def upsert_recording(
+        self,
+        recording_id: str,
+        couple_id: str,
+        transcript: str,
+        transcript_compact: str | None = None,
+        created_at: str | None = None,
+    ) -> str:
+        """Inserts a recording under an id the caller chose, so that repeating the
+        call after a crash rewrites the same row instead of adding another.
+        created_at defaults to the time of the first insert"""
+        row = {
+            "id": recording_id,
+            "couple_id": couple_id,
+            "transcript": transcript,
+            "transcript_compact": transcript_compact,
+        }
+        if created_at:
+            row["created_at"] = created_at
+        self.client.table("recording").upsert(row, on_conflict="id").execute()
+        return recording_id
+
+    @instrumented("supabase")
+    def delete_recording(self, recording_id: str) -> None:
+        """Deletes a recording together with any analyses already stored for it"""
+        for table in ("window_analysis", "mode_analysis", "emotion_analysis"):
+            self.client.table(table).delete().eq("recording_id", recording_id).execute()
+        self.client.table("recording").delete().eq("id", recording_id).execute()
+
+    @instrumented("supabase")
+    def update_recording_transcript(
+        self, recording_id: str, transcript: str, transcript_compact: str | None = None
+    ) -> None:
+        self.client.table("recording").update(
             {
-                "couple_id": couple_id,
                 "transcript": transcript,
+                "transcript_compact": transcript_compact,
             }
-        ).execute()
+        ).eq("id", recording_id).execute()
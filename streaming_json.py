@@ -0,0 +1,79 @@
+import json
+
+
+class ArrayItemParser:
+    """Incrementally scans a streamed JSON object and returns the items of one of
+    its top-level array fields as soon as each item's closing brace arrives"""
+
+    def __init__(self, field: str) -> None:
+        self.key = json.dumps(field)
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.last_string = None
+        self.string_start = None
+        self.in_array = False
+        self.array_depth = None
+        self.item_start = None
+        self.expect_array = False
+
+    def feed(self, delta: str) -> list[dict]:
+        self.text += delta
+        items = []
+        text = self.text
+        for i in range(self.pos, len(text)):
+            c = text[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif c == "\\":
+                    self.escaped = True
+                elif c == '"':
+                    self.in_string = False
+                    self.last_string = text[self.string_start : i + 1]
+                continue
+            if c == '"':
+                self.in_string = True
+                self.string_start = i
+            elif c == ":":
+                # the field's value starts after the colon that follows its key
+                self.expect_array = self.depth == 1 and self.last_string == self.key
+            elif c in "[{":
+                self.depth += 1
+                if c == "[" and self.expect_array:
+                    self.in_array = True
+                    self.array_depth = self.depth
+                elif c == "{" and self.in_array and self.depth == self.array_depth + 1:
+                    self.item_start = i
+                self.expect_array = False
+            elif c in "]}":
+                if (
+                    c == "}"
+                    and self.in_array
+                    and self.depth == self.array_depth + 1
+                    and self.item_start is not None
+                ):
+                    items.append(json.loads(text[self.item_start : i + 1]))
+                    self.item_start = None
+                elif c == "]" and self.in_array and self.depth == self.array_depth:
+                    self.in_array = False
+                self.depth -= 1
+            elif not c.isspace():
+                self.expect_array = False
+        self.pos = len(text)
+        # text before an open item or string is never looked at again
+        keep_from = self.pos
+        if self.item_start is not None:
+            keep_from = self.item_start
+        if self.in_string:
+            keep_from = min(keep_from, self.string_start)
+        if keep_from:
+            self.text = text[keep_from:]
+            self.pos -= keep_from
+            if self.item_start is not None:
+                self.item_start -= keep_from
+            if self.string_start is not None:
+                self.string_start -= keep_from
+        return items
@@ -0,0 +1,4 @@
+-- Columnar encoding of the transcript (transcript.Transcript.encode), written
+-- next to the raw VTT so analyses need not parse it again. Rows written before
+-- this column existed keep it null and fall back to the VTT.
+alter table recording add column if not exists transcript_compact text;
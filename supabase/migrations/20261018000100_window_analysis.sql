@@ -0,0 +1,35 @@
+-- Analysis results per transcript window, keyed by the hash of the window's
+-- transcript, prompt and model (RecordingProcessor), so that unchanged windows
+-- are never analyzed twice.
+create table if not exists window_analysis (
+    hash text primary key,
+    recording_id uuid not null references recording (id) on delete cascade,
+    start_ms integer not null,
+    items jsonb not null,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists window_analysis_recording_id_idx
+    on window_analysis (recording_id);
+
+alter table window_analysis enable row level security;
+
+-- insert_mode_analysis and insert_emotion_analysis upsert on these columns,
+-- which PostgREST only accepts with a matching unique constraint. Earlier
+-- inserts may have stored duplicates, of which one row per key is kept.
+delete from mode_analysis a
+    using mode_analysis b
+    where a.recording_id = b.recording_id and a.ctid < b.ctid;
+
+alter table mode_analysis
+    add constraint mode_analysis_recording_id_key unique (recording_id);
+
+delete from emotion_analysis a
+    using emotion_analysis b
+    where a.recording_id = b.recording_id
+        and a."interval" = b."interval"
+        and a.ctid < b.ctid;
+
+alter table emotion_analysis
+    add constraint emotion_analysis_recording_id_interval_key
+    unique (recording_id, "interval");
@@ -0,0 +1,8 @@
+-- The chat's rolling summary and recent turns (chat_memory.ChatMemory) per
+-- couple, upserted on couple_id after every answer.
+create table if not exists chat_memory (
+    couple_id uuid primary key references couple (id) on delete cascade,
+    memory jsonb not null
+);
+
+alter table chat_memory enable row level security;
@@ -0,0 +1,199 @@
+import base64
+import json
+import re
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+import webvtt
+
+# a speaker label such as AssemblyAI's "A" or a Zoom display name like "Jane Doe"
+SPEAKER_PREFIX = re.compile(r"^([^\W\d_][\w .'-]{0,63}): ")
+SERIALIZATION_MAGIC = b"RTR1"
+
+
+def timestamp_ms(timestamp: str) -> int:
+    hms, _, frac = timestamp.strip().partition(".")
+    fields = [int(f) for f in hms.split(":")]
+    while len(fields) < 3:
+        fields.insert(0, 0)
+    ms = int(frac[:3].ljust(3, "0")) if frac else 0
+    return ((fields[0] * 60 + fields[1]) * 60 + fields[2]) * 1000 + ms
+
+
+def format_timestamp(ms: int, with_ms: bool = True) -> str:
+    secs, ms = divmod(ms, 1000)
+    mins, secs = divmod(secs, 60)
+    hours, mins = divmod(mins, 60)
+    if with_ms:
+        return f"{hours:02d}:{mins:02d}:{secs:02d}.{ms:03d}"
+    return f"{hours:02d}:{mins:02d}:{secs:02d}"
+
+
+class Transcript:
+    """Columnar transcript: parallel arrays of cue times and speaker ids, with the
+    cue texts stored back to back in one buffer"""
+
+    def __init__(
+        self,
+        start_ms: array,
+        end_ms: array,
+        speaker_ids: array,
+        speakers: list[str],
+        text: str,
+        text_offsets: array,
+    ) -> None:
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.speaker_ids = speaker_ids
+        self.speakers = speakers
+        self.text = text
+        self.text_offsets = text_offsets
+
+    @classmethod
+    def from_vtt(cls, transcript_vtt: str) -> "Transcript":
+        start_ms, end_ms, speaker_ids = array("i"), array("i"), array("h")
+        speakers, texts, text_offsets = [], [], array("i", [0])
+        speaker_index = {}
+        offset = 0
+        for caption in webvtt.from_string(transcript_vtt):
+            text = caption.text
+            speaker_id = -1
+            match = SPEAKER_PREFIX.match(text)
+            if match:
+                speaker = match.group(1)
+                if speaker not in speaker_index:
+                    speaker_index[speaker] = len(speakers)
+                    speakers.append(speaker)
+                speaker_id = speaker_index[speaker]
+                text = text[match.end() :]
+            start_ms.append(timestamp_ms(caption.start))
+            end_ms.append(timestamp_ms(caption.end))
+            speaker_ids.append(speaker_id)
+            texts.append(text)
+            offset += len(text)
+            text_offsets.append(offset)
+        return cls(
+            start_ms, end_ms, speaker_ids, speakers, "".join(texts), text_offsets
+        )
+
+    def __len__(self) -> int:
+        return len(self.start_ms)
+
+    @property
+    def duration_ms(self) -> int:
+        return max(self.end_ms) if len(self) else 0
+
+    def text_at(self, i: int) -> str:
+        return self.text[self.text_offsets[i] : self.text_offsets[i + 1]]
+
+    def speaker_at(self, i: int) -> str | None:
+        speaker_id = self.speaker_ids[i]
+        return self.speakers[speaker_id] if speaker_id >= 0 else None
+
+    def slice(self, start_ms: int, end_ms: int) -> "Transcript":
+        """Cues overlapping [start_ms, end_ms); cue ends must be non-decreasing"""
+        lo = bisect_right(self.end_ms, start_ms)
+        hi = bisect_left(self.start_ms, end_ms)
+        hi = max(lo, hi)
+        text_start, text_end = self.text_offsets[lo], self.text_offsets[hi]
+        return Transcript(
+            self.start_ms[lo:hi],
+            self.end_ms[lo:hi],
+            self.speaker_ids[lo:hi],
+            self.speakers,
+            self.text[text_start:text_end],
+            array("i", (o - text_start for o in self.text_offsets[lo : hi + 1])),
+        )
+
+    def windows(self, window_ms: int, overlap_ms: int) -> list["Window"]:
+        return [
+            Window(
+                start_ms,
+                start_ms + window_ms,
+                self.slice(start_ms - overlap_ms, start_ms + window_ms + overlap_ms),
+            )
+            for start_ms in range(0, self.duration_ms, window_ms)
+        ]
+
+    def speaker_stats(self) -> dict[str, dict]:
+        stats = {
+            s: {"num_cues": 0, "talk_ms": 0, "num_chars": 0} for s in self.speakers
+        }
+        for i in range(len(self)):
+            speaker = self.speaker_at(i)
+            if speaker is None:
+                continue
+            stats[speaker]["num_cues"] += 1
+            stats[speaker]["talk_ms"] += self.end_ms[i] - self.start_ms[i]
+            stats[speaker]["num_chars"] += (
+                self.text_offsets[i + 1] - self.text_offsets[i]
+            )
+        return stats
+
+    def to_vtt(self) -> str:
+        cues = []
+        for i in range(len(self)):
+            speaker = self.speaker_at(i)
+            text = self.text_at(i)
+            cues.append(
+                f"{format_timestamp(self.start_ms[i])} --> {format_timestamp(self.end_ms[i])}\n"
+                + (f"{speaker}: {text}" if speaker else text)
+            )
+        return "WEBVTT\n\n" + "\n\n".join(cues)
+
+    def to_bytes(self) -> bytes:
+        speakers = json.dumps(self.speakers).encode()
+        text = self.text.encode()
+        columns = [self.start_ms, self.end_ms, self.speaker_ids, self.text_offsets]
+        if sys.byteorder == "big":
+            columns = [array(c.typecode, c) for c in columns]
+            for c in columns:
+                c.byteswap()
+        payload = b"".join(
+            [struct.pack("<III", len(self), len(speakers), len(text)), speakers, text]
+            + [c.tobytes() for c in columns]
+        )
+        return SERIALIZATION_MAGIC + zlib.compress(payload)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Transcript":
+        if not data.startswith(SERIALIZATION_MAGIC):
+            raise ValueError("Not a serialized transcript")
+        payload = zlib.decompress(data[len(SERIALIZATION_MAGIC) :])
+        n, speakers_len, text_len = struct.unpack_from("<III", payload)
+        pos = struct.calcsize("<III")
+        speakers = json.loads(payload[pos : pos + speakers_len])
+        pos += speakers_len
+        text = payload[pos : pos + text_len].decode()
+        pos += text_len
+        columns = []
+        for typecode, length in (("i", n), ("i", n), ("h", n), ("i", n + 1)):
+            column = array(typecode)
+            size = column.itemsize * length
+            column.frombytes(payload[pos : pos + size])
+            if sys.byteorder == "big":
+                column.byteswap()
+            columns.append(column)
+            pos += size
+        start_ms, end_ms, speaker_ids, text_offsets = columns
+        return cls(start_ms, end_ms, speaker_ids, speakers, text, text_offsets)
+
+    def encode(self) -> str:
+        return base64.b64encode(self.to_bytes()).decode()
+
+    @classmethod
+    def decode(cls, encoded: str) -> "Transcript":
+        return cls.from_bytes(base64.b64decode(encoded))
+
+
+@dataclass
+class Window:
+    start_ms: int
+    end_ms: int
+    transcript: Transcript
+
+    def to_vtt(self) -> str:
+        return self.transcript.to_vtt()
@@ -1,77 +1,165 @@
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import os
+import threading
+import time
+from typing import Iterator
+from requests.adapters import HTTPAdapter
 
 
 def num_secs(timestamp: str) -> int:
     fields = timestamp.split(":")
-    return int(fields[0]) * 3600 + int(fields[1]) * 60
+    secs = int(float(fields[2])) if len(fields) > 2 else 0
+    return int(fields[0]) * 3600 + int(fields[1]) * 60 + secs
 
 
 def get_s3_object_keys(s3_client, prefix: str) -> list[str]:
     s3_bucket = os.getenv("S3_BUCKET")
-    contents = s3_client.list_objects(Bucket=s3_bucket, Prefix=prefix).get(
-        "Contents", []
-    )
-    return [c["Key"] for c in contents]
+    paginator = s3_client.get_paginator("list_objects_v2")
+    return [
+        c["Key"]
+        for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix)
+        for c in page.get("Contents", [])
+    ]
+
+
+TOKEN_URL = "https://zoom.us/oauth/token"
+API_URL = "https://api.zoom.us/v2"
+ZOOM_PAGE_SIZE = 300
+MAX_ZOOM_WORKERS = 8
+REQUEST_TIMEOUT_SECS = 30
+# refresh tokens this long before Zoom expires them
+TOKEN_REFRESH_MARGIN_SECS = 300
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+def _account_token(
+    session: requests.Session,
+    account_id: str,
+    client_id: str,
+    client_secret: str,
+    stale: str | None = None,
+) -> str:
+    """Returns the process-wide cached server-to-server OAuth token for the
+    account, fetching a new one when it is about to expire or was rejected"""
+    key = (account_id, client_id)
+    with _tokens_lock:
+        token, expires_at = _tokens.get(key, (None, 0))
+        if token and token != stale and time.time() < expires_at:
+            return token
+        response = session.post(
+            TOKEN_URL,
+            data={
+                "grant_type": "account_credentials",
+                "account_id": account_id,
+                "client_id": client_id,
+                "client_secret": client_secret,
+            },
+            timeout=REQUEST_TIMEOUT_SECS,
+        )
+        response.raise_for_status()
+        body = response.json()
+        expires_at = time.time() + body["expires_in"] - TOKEN_REFRESH_MARGIN_SECS
+        _tokens[key] = (body["access_token"], expires_at)
+        return body["access_token"]
 
 
 class ZoomClient:
 
-    def __init__(self) -> None:
+    def __init__(self, max_workers: int = MAX_ZOOM_WORKERS) -> None:
         self.account_id = os.environ["ZOOM_ACCOUNT_ID"]
         self.client_id = os.environ["ZOOM_CLIENT_ID"]
         self.client_secret = os.environ["ZOOM_CLIENT_SECRET"]
-        self.access_token = self.get_access_token()
-
-    def get_access_token(self):
-        data = {
-            "grant_type": "account_credentials",
-            "account_id": self.account_id,
-            "client_id": self.client_id,
-            "client_secret": self.client_secret,
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.meeting_recordings_cache = {}
+        self.lock = threading.Lock()
+
+    def get_access_token(self, stale: str | None = None) -> str:
+        return _account_token(
+            self.session, self.account_id, self.client_id, self.client_secret, stale
+        )
+
+    @property
+    def access_token(self) -> str:
+        return self.get_access_token()
+
+    def _get(self, path: str, params: dict | None = None) -> dict:
+        token = self.get_access_token()
+        for attempt in range(2):
+            response = self.session.get(
+                f"{API_URL}{path}",
+                headers={"Authorization": f"Bearer {token}"},
+                params=params,
+                timeout=REQUEST_TIMEOUT_SECS,
+            )
+            # the token may have been revoked or expired early; refresh it once
+            if response.status_code == 401 and not attempt:
+                token = self.get_access_token(stale=token)
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def _get_window(self, from_ts: datetime, to_ts: datetime) -> list[dict]:
+        params = {
+            "from": from_ts.strftime("%Y-%m-%d"),
+            "to": to_ts.strftime("%Y-%m-%d"),
+            "page_size": ZOOM_PAGE_SIZE,
         }
-        response = requests.post("https://zoom.us/oauth/token", data=data)
-        return response.json()["access_token"]
+        meetings = []
+        while True:
+            response_json = self._get("/users/me/recordings", params)
+            meetings.extend(response_json.get("meetings", []))
+            next_page_token = response_json.get("next_page_token")
+            if not next_page_token:
+                return meetings
+            params["next_page_token"] = next_page_token
 
-    def get_recordings(self, num_lookback_months: int) -> dict:
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-        url = f"https://api.zoom.us/v2/users/me/recordings"
-        rv = []
+    def iter_recordings(self, num_lookback_months: int) -> Iterator[dict]:
+        """Yields the meetings of every 30-day window, oldest first; the windows
+        are fetched concurrently and each one is paged to completion"""
+        now = datetime.now()
+        windows = []
         for m in range(num_lookback_months, 0, -1):
-            from_ts = datetime.now() - timedelta(days=30 * m)
-            to_ts = from_ts + timedelta(days=30)
-            response_json = requests.get(
-                url,
-                headers=headers,
-                params={
-                    "from": from_ts.strftime("%Y-%m-%d"),
-                    "to": to_ts.strftime("%Y-%m-%d"),
-                    "page_size": 300,
-                },
-            ).json()
-            rv.extend(response_json["meetings"])
-        return rv
+            from_ts = now - timedelta(days=30 * m)
+            windows.append((from_ts, from_ts + timedelta(days=30)))
+        seen = set()
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(self.max_workers, len(windows)))
+        ) as executor:
+            for meetings in executor.map(lambda w: self._get_window(*w), windows):
+                for meeting in meetings:
+                    # adjacent windows share their boundary day
+                    if meeting["uuid"] not in seen:
+                        seen.add(meeting["uuid"])
+                        yield meeting
+
+    def get_recordings(self, num_lookback_months: int) -> list[dict]:
+        return list(self.iter_recordings(num_lookback_months))
 
     """
     usage
-    for meeting in recs:
-        transcript_download_url = [
-            f["download_url"]
-            for f in meeting["recording_files"]
-            if f["file_type"] == "TRANSCRIPT"
-        ][0]
-        transcript_download_url = (
-            f"{transcript_download_url}?access_token={client.access_token}"
-        )
+    for meeting in client.iter_recordings(num_lookback_months):
+        transcript_download_url = client.get_transcript_download_url(meeting["id"])
         name = f"{meeting['topic']}_{meeting['start_time']}"
     """
 
-    def get_audio_download_url(self, meeting_id):
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-        url = f"https://api.zoom.us/v2/meetings/{meeting_id}/recordings"
-        r = requests.get(url, headers=headers).json()
+    def get_meeting_recordings(self, meeting_id) -> dict:
+        with self.lock:
+            cached = self.meeting_recordings_cache.get(meeting_id)
+        if cached is None:
+            cached = self._get(f"/meetings/{meeting_id}/recordings")
+            with self.lock:
+                self.meeting_recordings_cache[meeting_id] = cached
+        return cached
 
+    def get_audio_download_url(self, meeting_id):
+        r = self.get_meeting_recordings(meeting_id)
         url = [
             i["download_url"]
             for i in r["recording_files"]
@@ -81,10 +169,7 @@ class ZoomClient:
         return download_link
 
     def get_transcript_download_url(self, meeting_id):
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-        url = f"https://api.zoom.us/v2/meetings/{meeting_id}/recordings"
-        r = requests.get(url, headers=headers).json()
-
+        r = self.get_meeting_recordings(meeting_id)
         url = [
             i["download_url"]
             for i in r["recording_files"]